@@ -1,13 +1,30 @@
 import pandas as pd
-from predict.forecast_model import RegressionYouBikeModel
+from predict.forecast_model import FORECAST_MODEL_NAME, RegressionYouBikeModel
 from utils.s3_helper import ConnectionToS3
-from utils import utils
-from utils.sql_utils import DB_Connection, SQL_INSERT_STATEMENT_FROM_DATAFRAME
+from utils.sql_utils import (
+    DB_Connection,
+    acquire_lease,
+    is_lease_held,
+    release_lease,
+)
+from utils.station_registry import StationRegistry
 from sqlalchemy import text
 import json
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
 from typing import Union
 from etl.transform.features_creator import FeaturesCreator_v1
+from db.main import db_insert_fill_rate_forecast
+
+FORECAST_FRESHNESS_MINUTES = int(os.getenv("FORECAST_FRESHNESS_MINUTES", 15))
+REFRESH_LEASE_TTL = 120  # seconds, upper bound of a forecast refresh
+REFRESH_POLL_INTERVAL = 0.5  # seconds
+
 
 class YoubikeForecastService:
     """Service responsible for providing and maintaining a time-valid forecast.
@@ -25,6 +42,14 @@ class YoubikeForecastService:
             self._model = forecast_model
             self._s3 = s3
             self._freshness_thresh = freshness_thresh
+            self._holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self._inflight_refreshes: dict[str, threading.Event] = {}
+            self._inflight_lock = threading.Lock()
+            self._refresh_metrics = {
+                "refreshes": 0,
+                "coalesced_in_process": 0,
+                "coalesced_cross_process": 0,
+            }
             YoubikeForecastService._unique_instance = self
 
     @classmethod
@@ -32,7 +57,7 @@ class YoubikeForecastService:
         if cls._unique_instance is None:
             cls._unique_instance = cls(
                 RegressionYouBikeModel(
-                    "model_2024-03-29",
+                    FORECAST_MODEL_NAME,
                 ),
                 ConnectionToS3.from_env(),
                 freshness_thresh,
@@ -55,27 +80,89 @@ class YoubikeForecastService:
         if len(station_ids) < 1:
             raise ValueError("station_ids parameter must be non-null")
 
-        with DB_Connection.from_env().connection as conn:
-            res = conn.execute(text('SELECT "id" from bike_station;')).all()
-            all_stations_ids = [x[0] for x in res]
-        if set(station_ids) - set(all_stations_ids) != set():
-            raise ValueError(
-                f"Invalid station ids provided {set(station_ids) - set(all_stations_ids)}"
-            )
+        invalid_station_ids = set(station_ids) - StationRegistry.get_instance().station_ids()
+        if invalid_station_ids != set():
+            raise ValueError(f"Invalid station ids provided {invalid_station_ids}")
 
         existing_valid_forecast = self.__retrieve_valid_forecast_from_db(station_ids)
         stations_to_refresh = list(
             set(station_ids) - set(existing_valid_forecast["station_id"])
         )
         print("No valid forecast found for: ", stations_to_refresh)
-        
-        fresh_forecast = self.__get_new_forecast(stations_to_refresh)
-        if fresh_forecast is not None:
-            self.__update_db_fill_rate_forecast(fresh_forecast)
+
+        if len(stations_to_refresh):
+            self.__refresh_single_flight(stations_to_refresh)
 
         all_forecasts = self.__retrieve_valid_forecast_from_db(station_ids)
         return all_forecasts
 
+    @property
+    def refresh_metrics(self) -> dict:
+        """Count of refreshes computed by this process, and of requests that waited for another caller's refresh instead"""
+        return dict(self._refresh_metrics)
+
+    def __refresh_single_flight(self, station_ids: list[int]) -> None:
+        """
+        Refresh the forecasts of station_ids, making sure a single caller computes it.
+        Concurrent callers for the same stations and time bucket wait for that caller instead:
+        threads of this process via an in-flight event, other processes via a db lease.
+        """
+        refresh_key = self.__refresh_key(station_ids)
+        with self._inflight_lock:
+            inflight = self._inflight_refreshes.get(refresh_key)
+            is_leader = inflight is None
+            if is_leader:
+                inflight = self._inflight_refreshes[refresh_key] = threading.Event()
+            else:
+                self._refresh_metrics["coalesced_in_process"] += 1
+
+        if not is_leader:
+            inflight.wait(timeout=REFRESH_LEASE_TTL)
+            return
+
+        try:
+            with DB_Connection.from_env() as conn:
+                is_lease_acquired = acquire_lease(
+                    conn, refresh_key, self._holder_id, REFRESH_LEASE_TTL
+                )
+            if not is_lease_acquired:
+                self._refresh_metrics["coalesced_cross_process"] += 1
+                self.__wait_for_lease(refresh_key)
+                return
+
+            try:
+                # Another process may have refreshed while this one was waiting for the lease
+                still_stale = set(station_ids) - set(
+                    self.__retrieve_valid_forecast_from_db(station_ids)["station_id"]
+                )
+                fresh_forecast = self.__get_new_forecast(list(still_stale))
+                if fresh_forecast is not None:
+                    self.__update_db_fill_rate_forecast(fresh_forecast)
+                    self._refresh_metrics["refreshes"] += 1
+            finally:
+                with DB_Connection.from_env() as conn:
+                    release_lease(conn, refresh_key, self._holder_id)
+        finally:
+            with self._inflight_lock:
+                del self._inflight_refreshes[refresh_key]
+            inflight.set()
+
+    def __refresh_key(self, station_ids: list[int]) -> str:
+        """Identifies a refresh by the set of stations and the freshness time bucket it falls in"""
+        time_bucket = int(time.time() // (self._freshness_thresh * 60))
+        stations_digest = hashlib.sha1(
+            ",".join([str(x) for x in sorted(station_ids)]).encode()
+        ).hexdigest()
+        return f"fill_rate_forecast:{time_bucket}:{stations_digest}"
+
+    def __wait_for_lease(self, refresh_key: str) -> None:
+        deadline = time.monotonic() + REFRESH_LEASE_TTL
+        while time.monotonic() < deadline:
+            with DB_Connection.from_env() as conn:
+                if not is_lease_held(conn, refresh_key):
+                    return
+            time.sleep(REFRESH_POLL_INTERVAL)
+
     def __retrieve_valid_forecast_from_db(self, station_ids: list[int]) -> pd.DataFrame:
         """Retrieves forecast from DB and return only valid forecast
 
@@ -83,12 +170,27 @@ class YoubikeForecastService:
             Dataframe with db.fill_rate_forecast schema
         """
         VALIDITY_THRESH = datetime.now() - timedelta(minutes=self._freshness_thresh)
-        with DB_Connection.from_env().connection as conn:
-            fields = conn.execute(text("SELECT * FROM fill_rate_forecast;")).keys()
-            fill_forecasts = pd.DataFrame(columns=fields)
-            request_sql = f"SELECT * FROM fill_rate_forecast WHERE station_id in ({', '.join([str(x) for x in station_ids])}) AND run_ts > '{VALIDITY_THRESH}'" + 'ORDER BY "station_id", "relative_ts" ASC;'
-            res = conn.execute(text(request_sql))
-            fill_forecasts = pd.concat([fill_forecasts, pd.DataFrame(res)])
+        # Latest valid run per requested station, served by fill_rate_forecast_station_run_idx
+        request_sql = text(
+            """
+            SELECT f.* FROM fill_rate_forecast f
+            JOIN (
+                SELECT DISTINCT ON ("station_id") "station_id", "run_ts" FROM fill_rate_forecast
+                WHERE "station_id" = ANY(:station_ids) AND "run_ts" > :validity_thresh
+                ORDER BY "station_id", "run_ts" DESC
+            ) latest ON f."station_id" = latest."station_id" AND f."run_ts" = latest."run_ts"
+            ORDER BY f."station_id", f."relative_ts" ASC;
+            """
+        )
+        with DB_Connection.from_env() as conn:
+            res = conn.execute(
+                request_sql,
+                {
+                    "station_ids": [int(x) for x in station_ids],
+                    "validity_thresh": VALIDITY_THRESH,
+                },
+            )
+            fill_forecasts = pd.DataFrame(res.all(), columns=list(res.keys()))
 
         return fill_forecasts
 
@@ -102,18 +204,7 @@ class YoubikeForecastService:
         -------
             None
         """
-        forecasts["base_ts"] = forecasts["base_ts"].dt.strftime(utils.DB_TS_FORMAT)
-        forecasts["run_ts"] = forecasts["run_ts"].dt.strftime(utils.DB_TS_FORMAT)
-
-        statement = SQL_INSERT_STATEMENT_FROM_DATAFRAME(
-            forecasts[["station_id", "fill_rate", "relative_ts", "base_ts", "run_ts"]],
-            "fill_rate_forecast",
-        )
-        sql_confict = ' ON CONFLICT ("station_id", "relative_ts", "run_ts") DO NOTHING'
-        statement = statement.split(";")[0] + sql_confict + ";"
-        with DB_Connection.from_env().connection as conn:
-            conn.execute(text(statement))
-            conn.commit()
+        db_insert_fill_rate_forecast(forecasts)
 
     def __get_new_forecast(self, station_ids: list[int]) -> Union[pd.DataFrame, None]:
         """
@@ -135,7 +226,9 @@ def get_fill_rate_forecast(station_id: list[int] = []):
     ------
         return fill_rate_forecast with db schema
     """
-    forecaster = YoubikeForecastService.get_instance(freshness_thresh=5)
+    forecaster = YoubikeForecastService.get_instance(
+        freshness_thresh=FORECAST_FRESHNESS_MINUTES
+    )
     return forecaster.get_forecast(station_id)
 
 
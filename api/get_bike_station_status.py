@@ -5,21 +5,28 @@ import pandas as pd
 from etl.extraction import youbike
 from etl.transform import clean_youbike_data
 from db import main
+from utils.geo import StationNeighborIndex
+from utils.station_status_state import SYNC_ROW_ID
 
 
 def get_bike_station_status(extended: bool = False):
 
     # Check if DB has already fresh data - if no refresh, update and serve
     MIN_UNTIL_REFRESH = 5
-    query = "SELECT * from bike_station_status bss;"
+    # updated_at is the last sync, as only changed stations are written. changed_at is the last change of the station.
+    query = (
+        'SELECT bss."id", bss."full", bss."empty", COALESCE(s."synced_at", bss."updated_at") AS "updated_at", '
+        'bss."updated_at" AS "changed_at" FROM bike_station_status bss '
+        f'LEFT JOIN bike_station_status_sync s ON s."id" = {SYNC_ROW_ID};'
+    )
 
     if extended:
-        query = query.split(";")[0] + " JOIN bike_station bs ON bs.id = bss.id;"
+        query = query.replace(" FROM", ", bs.* FROM", 1).split(";")[0]
+        query += " JOIN bike_station bs ON bs.id = bss.id;"
 
-    with DB_Connection.from_env().connection as conn:
+    with DB_Connection.from_env() as conn:
         bike_station_status_rows = conn.execute(text(query)).all()
 
-        # Assumes table is always recreated on refresh
         if bike_station_status_rows[0][3] < (
             datetime.now() - timedelta(minutes=MIN_UNTIL_REFRESH)
         ):
@@ -40,6 +47,38 @@ def get_bike_station_status(extended: bool = False):
     return bike_station_status_df
 
 
+def get_bike_station_status_changed_since(ts: datetime) -> pd.DataFrame:
+    """
+    Status of the stations whose full / empty changed after ts, for clients polling incrementally instead of
+    pulling every station. Returns id, full, empty, changed_at, and synced_at, the time of the last snapshot,
+    to pass as ts on the next call.
+    """
+    query = text(
+        'SELECT bss."id", bss."full", bss."empty", bss."updated_at" AS "changed_at", s."synced_at" '
+        "FROM bike_station_status bss "
+        f'LEFT JOIN bike_station_status_sync s ON s."id" = {SYNC_ROW_ID} '
+        'WHERE bss."updated_at" > :ts;'
+    )
+    with DB_Connection.from_env() as conn:
+        res = conn.execute(query, {"ts": ts})
+        return pd.DataFrame(res.all(), columns=list(res.keys()))
+
+
+def get_nearest_stations_with_bikes(
+    lat: float, lng: float, n: int = 3, search_k: int = 50
+) -> pd.DataFrame:
+    """
+    The n nearest stations with at least one bike, among the search_k nearest stations of the point.
+    Returns id, distance_km, full and empty, nearest first.
+    """
+    ids, distances = StationNeighborIndex.get_instance().k_nearest([lat], [lng], search_k)
+    bike_station_status_df = get_bike_station_status(extended=False)
+    nearest_df = pd.DataFrame({"id": ids[0], "distance_km": distances[0]}).merge(
+        bike_station_status_df[["id", "full", "empty"]], on="id"
+    )
+    return nearest_df[nearest_df["full"] > 0].head(n).reset_index(drop=True)
+
+
 if __name__ == "__main__":
     test_station_ids = [
         508201032,
@@ -1,4 +1,5 @@
 import json
+from datetime import datetime
 from api.forecast_service import get_fill_rate_forecast
 import api.get_bike_station_status
 
@@ -15,6 +16,10 @@ def lambda_handler(event: dict, context):
         case 'bike_station_status':
             
             res = api.get_bike_station_status.get_bike_station_status(bool(event_body["extended"]))
+        case 'bike_station_status_changed_since':
+            res = api.get_bike_station_status.get_bike_station_status_changed_since(
+                datetime.fromisoformat(event_body["since"])
+            )
         case 'fill_rate_forecast':
             res = get_fill_rate_forecast(event_body["station_id"])
 
@@ -0,0 +1,63 @@
+import time
+import pandas as pd
+from sqlalchemy import text
+from benchmarks.common import make_station_counts
+from utils import sql_utils
+
+# Compares the legacy INSERT string builder against the COPY based bulk upsert.
+# Writes to a scratch table in the database pointed at by DATABASE_URL:  python -m benchmarks.bulk_write
+BENCHMARK_TABLE = "benchmark_bike_station_status"
+ROW_COUNTS = [1_000, 10_000, 100_000]
+
+
+def make_status_rows(n: int) -> pd.DataFrame:
+    df = make_station_counts(n, n)[["id", "full", "empty"]]
+    df["updated_at"] = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+    return df
+
+
+def write_with_string_builder(conn, df: pd.DataFrame) -> None:
+    statement = sql_utils.SQL_INSERT_STATEMENT_FROM_DATAFRAME(df, BENCHMARK_TABLE)
+    upsert_sql = ' ON CONFLICT ("id") DO UPDATE SET "full" = EXCLUDED."full", "empty" = EXCLUDED."empty", "updated_at" = EXCLUDED."updated_at"'
+    conn.execute(text(statement.split(";")[0] + upsert_sql + ";"))
+
+
+def write_with_copy(conn, df: pd.DataFrame) -> None:
+    sql_utils.bulk_upsert_dataframe(
+        conn,
+        df,
+        BENCHMARK_TABLE,
+        conflict_columns=["id"],
+        update_columns=["full", "empty", "updated_at"],
+    )
+
+
+def rows_per_sec(writer, df: pd.DataFrame) -> float:
+    with sql_utils.DB_Connection.from_env() as conn:
+        conn.execute(text(f"DELETE FROM {BENCHMARK_TABLE};"))
+        conn.commit()
+        start = time.perf_counter()
+        writer(conn, df)
+        conn.commit()
+        return len(df) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    with sql_utils.DB_Connection.from_env() as conn:
+        conn.execute(
+            text(
+                f'CREATE TABLE IF NOT EXISTS {BENCHMARK_TABLE}("id" integer PRIMARY KEY,  "full" smallint, "empty" smallint, "updated_at" timestamp (0));'
+            )
+        )
+        conn.commit()
+
+    print(f"{'rows':>8} {'string builder (rows/s)':>24} {'COPY (rows/s)':>14}")
+    for n in ROW_COUNTS:
+        df = make_status_rows(n)
+        legacy = rows_per_sec(write_with_string_builder, df)
+        bulk = rows_per_sec(write_with_copy, df)
+        print(f"{n:>8} {legacy:>24.0f} {bulk:>14.0f}")
+
+    with sql_utils.DB_Connection.from_env() as conn:
+        conn.execute(text(f"DROP TABLE {BENCHMARK_TABLE};"))
+        conn.commit()
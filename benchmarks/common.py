@@ -0,0 +1,47 @@
+import time
+import numpy as np
+import pandas as pd
+
+# Shared timer and synthetic data builders of the benchmarks. Each benchmark compares the previous implementation
+# of a code path against the current one, and checks that both return the same values:
+#   python -m benchmarks.<name>
+SNAPSHOT_START = pd.Timestamp("2024-04-01", tz="Asia/Taipei")
+SNAPSHOT_FREQ = "10min"
+
+
+def time_it(fn, *args, repeats: int = 1) -> tuple[float, object]:
+    """Mean wall time in seconds of fn(*args) over repeats runs, and the output of the last run"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn(*args)
+    return (time.perf_counter() - start) / repeats, out
+
+
+def make_points(n: int, seed: int) -> pd.DataFrame:
+    """lat, lng of n points drawn uniformly over Taiwan"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"lat": rng.uniform(22, 25.3, n), "lng": rng.uniform(120, 121.9, n)})
+
+
+def make_station_counts(n: int, seed: int, first_id: int = 0) -> pd.DataFrame:
+    """id, space, full, empty of n stations"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "id": np.arange(first_id, first_id + n),
+            "space": rng.integers(10, 60, n),
+            "full": rng.integers(0, 30, n),
+            "empty": rng.integers(0, 30, n),
+        }
+    )
+
+
+def make_snapshot_grid(n_stations: int, n_snapshots: int) -> pd.DataFrame:
+    """station_id, extraction_ts of n_stations over n_snapshots consecutive snapshots from SNAPSHOT_START"""
+    extraction_ts = pd.date_range(SNAPSHOT_START, periods=n_snapshots, freq=SNAPSHOT_FREQ)
+    return pd.DataFrame(
+        {
+            "station_id": np.repeat(np.arange(n_stations), n_snapshots),
+            "extraction_ts": np.tile(extraction_ts, n_stations),
+        }
+    )
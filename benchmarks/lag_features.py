@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from benchmarks.common import make_snapshot_grid, time_it
+from etl.transform.features_lib import LagFeatures
+
+# Compares LagFeatures.in_pandas against the previous groupby-lambda implementation on synthetic data:
+#   python -m benchmarks.lag_features
+STATION_COUNTS = [1_000, 10_000]
+SNAPSHOT_COUNTS = [12, 1008]
+
+
+def make_synthetic_snapshots(n_stations: int, n_snapshots: int) -> pd.DataFrame:
+    df = make_snapshot_grid(n_stations, n_snapshots)
+    df["pct_full"] = np.random.default_rng(n_stations * n_snapshots).random(len(df))
+    return df.sample(frac=1, random_state=0, ignore_index=True)
+
+
+def legacy_lag_features(df: pd.DataFrame) -> pd.DataFrame:
+    df["30m_blag_pct_full"] = (
+        df.sort_values(by="extraction_ts")
+        .groupby(by=["station_id"])["pct_full"]
+        .transform(lambda x: x.shift(3))
+    )
+    df["120m_avg_pct_full"] = (
+        df.sort_values(by="extraction_ts")
+        .groupby(by=["station_id"])["pct_full"]
+        .transform(lambda x: x.rolling(window=12).mean())
+    )
+    return df
+
+
+if __name__ == "__main__":
+    print(f"{'stations':>9} {'snapshots':>10} {'groupby-lambda (s)':>19} {'vectorized (s)':>15}")
+    for n_stations in STATION_COUNTS:
+        for n_snapshots in SNAPSHOT_COUNTS:
+            df = make_synthetic_snapshots(n_stations, n_snapshots)
+            legacy_s, legacy_df = time_it(legacy_lag_features, df.copy())
+            # Full windows only, to match the row based rolling(12) on a gap-free grid
+            vectorized_s, vectorized_df = time_it(
+                LagFeatures("pandas", rolling_min_periods=12).run, df.copy()
+            )
+            for c in ["30m_blag_pct_full", "120m_avg_pct_full"]:
+                assert np.allclose(legacy_df[c], vectorized_df[c], equal_nan=True)
+            print(f"{n_stations:>9} {n_snapshots:>10} {legacy_s:>19.3f} {vectorized_s:>15.3f}")
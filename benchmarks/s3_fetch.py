@@ -0,0 +1,48 @@
+import os
+import pandas as pd
+from benchmarks.common import SNAPSHOT_START, make_points, make_station_counts, time_it
+from utils.s3_helper import ConnectionToS3, export_file_to_s3, read_parquet_objects
+
+# Compares serial and concurrent fetches of snapshot parquet files by read_parquet_objects.
+# Run against the local MinIO of docker/compose.yaml:  APP_ENV=local python -m benchmarks.s3_fetch
+BENCHMARK_PREFIX = "benchmark/youbike_dock_info_"
+SNAPSHOT_COUNTS = [13, 144, 1008]
+STATIONS_PER_SNAPSHOT = 8000
+
+
+def make_synthetic_snapshot(i: int) -> bytes:
+    df = pd.concat(
+        [
+            make_station_counts(STATIONS_PER_SNAPSHOT, i, first_id=500000000),
+            make_points(STATIONS_PER_SNAPSHOT, i),
+        ],
+        axis=1,
+    )
+    df["extraction_ts"] = SNAPSHOT_START + pd.Timedelta(minutes=10 * i)
+    return df.to_parquet(index=False)
+
+
+def upload_synthetic_snapshots(s3: ConnectionToS3, n: int) -> list[str]:
+    existing = {obj.key for obj in s3.Bucket.objects.filter(Prefix=BENCHMARK_PREFIX)}
+    keys = [f"{BENCHMARK_PREFIX}{i:04d}.parquet" for i in range(n)]
+    for i, key in enumerate(keys):
+        if key not in existing:
+            export_file_to_s3(s3, key, make_synthetic_snapshot(i))
+    return keys
+
+
+def fetch(s3: ConnectionToS3, keys: list[str], max_workers: int) -> pd.DataFrame:
+    return pd.concat(read_parquet_objects(s3, keys, max_workers), ignore_index=True)
+
+
+if __name__ == "__main__":
+    if os.getenv("APP_ENV", "local") != "local":
+        raise Exception("This benchmark writes to the bucket. Only run it with APP_ENV=local.")
+
+    s3 = ConnectionToS3.from_env()
+    keys = upload_synthetic_snapshots(s3, max(SNAPSHOT_COUNTS))
+
+    print(f"{'snapshots':>10} {'serial (s)':>12} {'8 workers (s)':>14} {'16 workers (s)':>15}")
+    for n in SNAPSHOT_COUNTS:
+        timings = [time_it(fetch, s3, keys[:n], w)[0] for w in [1, 8, 16]]
+        print(f"{n:>10} {timings[0]:>12.2f} {timings[1]:>14.2f} {timings[2]:>15.2f}")
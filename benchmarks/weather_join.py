@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from benchmarks.common import SNAPSHOT_START, make_snapshot_grid, time_it
+from etl.transform.features_lib import (
+    WEATHER_FEATURE_COLUMNS,
+    epoch_hours,
+    weather_lookup_table,
+)
+
+# Compares the youbike to weather join on a strftime string key against the epoch-hour key,
+# on a month of synthetic 10 minutes snapshots:
+#   python -m benchmarks.weather_join
+STATION_COUNTS = [1_000, 3_000]
+N_DAYS = 30
+N_ZONES = 12
+
+
+def make_synthetic_data(n_stations: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    rng = np.random.default_rng(n_stations)
+    n_snapshots = N_DAYS * 24 * 6
+    snapshots = make_snapshot_grid(n_stations, n_snapshots)
+    snapshots["weather_zone_id"] = np.repeat(rng.integers(0, N_ZONES, n_stations), n_snapshots)
+    snapshots["weather_zone"] = "zone_" + snapshots["weather_zone_id"].astype(str)
+
+    hours = pd.date_range(SNAPSHOT_START, periods=N_DAYS * 24, freq="h")
+    weather = pd.DataFrame(
+        {
+            "weather_zone_id": np.repeat(np.arange(N_ZONES), len(hours)),
+            "datetime": np.tile(hours, N_ZONES),
+        }
+    )
+    weather["weather_zone"] = "zone_" + weather["weather_zone_id"].astype(str)
+    for c in WEATHER_FEATURE_COLUMNS:
+        weather[c] = rng.random(len(weather)).astype(np.float32)
+    return snapshots, weather
+
+
+def string_key_join(snapshots: pd.DataFrame, weather: pd.DataFrame) -> pd.DataFrame:
+    snapshots["y_m_d_h"] = snapshots["extraction_ts"].dt.strftime("%Y-%m-%d_%H")
+    weather["y_m_d_h"] = weather["datetime"].dt.strftime("%Y-%m-%d_%H")
+    return pd.merge(
+        left=snapshots,
+        right=weather[["weather_zone", "y_m_d_h"] + WEATHER_FEATURE_COLUMNS],
+        on=["weather_zone", "y_m_d_h"],
+        how="left",
+    )
+
+
+def epoch_hour_join(snapshots: pd.DataFrame, weather: pd.DataFrame) -> pd.DataFrame:
+    snapshots["epoch_hour"] = epoch_hours(snapshots["extraction_ts"])
+    return snapshots.join(
+        weather_lookup_table(weather), on=["weather_zone_id", "epoch_hour"]
+    )
+
+
+if __name__ == "__main__":
+    print(f"{'stations':>9} {'rows':>11} {'strftime key (s)':>17} {'epoch hour (s)':>15}")
+    for n_stations in STATION_COUNTS:
+        snapshots, weather = make_synthetic_data(n_stations)
+        string_s, string_df = time_it(string_key_join, snapshots.copy(), weather.copy())
+        epoch_s, epoch_df = time_it(epoch_hour_join, snapshots.copy(), weather.copy())
+        for c in WEATHER_FEATURE_COLUMNS:
+            assert np.allclose(string_df[c], epoch_df[c], equal_nan=True)
+        print(f"{n_stations:>9} {len(snapshots):>11} {string_s:>17.3f} {epoch_s:>15.3f}")
@@ -0,0 +1,51 @@
+import warnings
+import numpy as np
+import pandas as pd
+from benchmarks.common import make_points, time_it
+from utils.geo import WeatherZoneLocator
+
+# Compares WeatherZoneLocator against the previous per-zone iterrows loop on synthetic stations and zones:
+#   python -m benchmarks.weather_zone
+N_STATIONS = 10_000
+ZONE_COUNTS = [16, 256]
+
+
+def legacy_identify_weather_zone(
+    lat: pd.Series, lng: pd.Series, weather_zones: pd.DataFrame
+) -> pd.Series:
+    def np_magnitude(coord1, coord2):
+        lat_vector = np.power(coord1["lat"] - coord2["lat"], 2)
+        lng_vector = np.power(coord1["lng"] - coord2["lng"], 2)
+        return np.sqrt(lat_vector + lng_vector)
+
+    mag = pd.DataFrame({"lat": lat, "lng": lng}).loc[:]
+    for i, r in weather_zones.iterrows():
+        mag[r["name"]] = np_magnitude(
+            pd.DataFrame({"lat": lat, "lng": lng}),
+            weather_zones[weather_zones["name"] == r["name"]].iloc[0],
+        )
+    return mag.drop(["lat", "lng"], axis=1).idxmin(axis=1)
+
+
+if __name__ == "__main__":
+    # The legacy loop inserts one column per zone
+    warnings.simplefilter("ignore", pd.errors.PerformanceWarning)
+    stations = make_points(N_STATIONS, 0)
+    print(f"{'zones':>6} {'iterrows (s)':>13} {'locator (s)':>12} {'same zone':>10}")
+    for n_zones in ZONE_COUNTS:
+        weather_zones = make_points(n_zones, n_zones)
+        weather_zones["id"] = np.arange(n_zones)
+        weather_zones["name"] = "zone_" + weather_zones["id"].astype(str)
+
+        legacy_s, legacy_zones = time_it(
+            legacy_identify_weather_zone, stations["lat"], stations["lng"], weather_zones
+        )
+        # Includes building the centroids, and the BallTree above BALL_TREE_MIN_ZONES zones
+        locator_s, locator_zones = time_it(
+            lambda: WeatherZoneLocator(weather_zones).nearest_zone_name(
+                stations["lat"], stations["lng"]
+            )
+        )
+        # Haversine and raw degree distances disagree near zone boundaries
+        same_zone = (legacy_zones == locator_zones).mean()
+        print(f"{n_zones:>6} {legacy_s:>13.3f} {locator_s:>12.3f} {same_zone:>10.1%}")
@@ -0,0 +1,73 @@
+import sys
+import numpy as np
+import pandas as pd
+import requests
+from io import BytesIO, StringIO
+from benchmarks.common import make_points, make_station_counts, time_it
+from etl.extraction.youbike import TIMEZONE, URL, parse_youbike_feed
+
+# Compares parse_youbike_feed against the previous decode + read_csv inference path on a recorded feed:
+#   python -m benchmarks.youbike_parse --record /tmp/youbike-station.csv
+#   python -m benchmarks.youbike_parse /tmp/youbike-station.csv
+# Without a recorded feed, a synthetic one with the same columns is used.
+SYNTHETIC_STATIONS = 8000
+REPEATS = 20
+
+
+def make_synthetic_feed(n_stations: int) -> bytes:
+    rng = np.random.default_rng(0)
+    stations = make_station_counts(n_stations, 0, first_id=500101001)
+    points = make_points(n_stations, 0)
+    df = pd.DataFrame(
+        {
+            "id": stations["id"],
+            "name": [f"YouBike2.0_站點{i}" for i in range(n_stations)],
+            "type": 2,
+            "space": stations["space"],
+            "full": stations["full"],
+            "empty": stations["empty"],
+            "bike_yb1": 0,
+            "bike_yb2": stations["full"],
+            "bike_eyb": rng.integers(0, 3, n_stations),
+            "city": "台北市",
+            "area": "大安區",
+            "lat": points["lat"],
+            "lng": points["lng"],
+            "place_id": rng.integers(0, 10**6, n_stations).astype(np.float64),
+            "address": [f"復興南路二段{i}號" for i in range(n_stations)],
+            "is_open": 1,
+            "updated_at": 1712000000 + rng.integers(0, 600, n_stations),
+        }
+    )
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def legacy_parse(feed: bytes) -> pd.DataFrame:
+    df = pd.read_csv(StringIO(feed.decode("utf-8")))
+    df["last_update_ts"] = (
+        pd.to_datetime(df["updated_at"], unit="s")
+        .dt.tz_localize(tz="UTC")
+        .dt.tz_convert(tz=TIMEZONE)
+    )
+    df["last_update_ts"] = df["last_update_ts"].astype(f"datetime64[ms, {TIMEZONE}]")
+    return df.drop(labels=["updated_at"], axis=1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--record":
+        with open(sys.argv[2], "wb") as f:
+            f.write(requests.get(URL).content)
+        print("Recorded feed at: ", sys.argv[2])
+        sys.exit()
+
+    if len(sys.argv) == 2:
+        with open(sys.argv[1], "rb") as f:
+            feed = f.read()
+    else:
+        feed = make_synthetic_feed(SYNTHETIC_STATIONS)
+
+    legacy_s, legacy_df = time_it(legacy_parse, feed, repeats=REPEATS)
+    typed_s, typed_df = time_it(lambda b: parse_youbike_feed(BytesIO(b)), feed, repeats=REPEATS)
+    pd.testing.assert_frame_equal(legacy_df, typed_df)
+    print(f"{'rows':>6} {'read_csv inference (ms)':>24} {'typed pyarrow (ms)':>19}")
+    print(f"{len(typed_df):>6} {1000 * legacy_s:>24.2f} {1000 * typed_s:>19.2f}")
@@ -1,27 +1,46 @@
-from sqlalchemy import text
 import pandas as pd
 from utils import sql_utils, utils
+from utils.station_registry import StationRegistry
+from utils.geo import WeatherZoneLocator, StationNeighborIndex
+from utils.station_status_state import StationStatusState, SYNC_ROW_ID
+from sqlalchemy import text
 from datetime import datetime
 import pytz
 
 
 def db_update_bike_station_status(df: pd.DataFrame):
-    """Upsert to the bike_station_status table in the database
+    """Upsert to the bike_station_status table in the database the stations whose full / empty changed,
+    with updated_at set to the extraction_ts of the snapshot they changed in. The extraction_ts of the
+    snapshot is recorded in bike_station_status_sync, as the time all the other stations were last confirmed.
     Expects a clean_youbike_data schema
     """
+    synced_at = df["extraction_ts"].iloc[0].to_pydatetime().replace(tzinfo=None)
     df["extraction_ts"] = df["extraction_ts"].dt.strftime(utils.DB_TS_FORMAT)
     df.rename(columns={"extraction_ts": "updated_at"}, inplace=True)
     columns = ["id", "full", "empty", "updated_at"]
 
-    statement = sql_utils.SQL_INSERT_STATEMENT_FROM_DATAFRAME(
-        df[columns], "bike_station_status"
-    )
-    upsert_sql = ' ON CONFLICT ("id") DO UPDATE SET "full" = EXCLUDED."full", "empty" = EXCLUDED."empty", "updated_at" = EXCLUDED."updated_at"'
-    statement = statement.split(";")[0] + upsert_sql + ";"
-
-    with sql_utils.DB_Connection.from_env()._connection as conn:
-        conn.execute(text(statement))
+    state = StationStatusState.get_instance()
+    with sql_utils.DB_Connection.from_env() as conn:
+        changed_df = state.changed_rows(conn, df)
+        sql_utils.bulk_upsert_dataframe(
+            conn,
+            changed_df[columns],
+            "bike_station_status",
+            conflict_columns=["id"],
+            update_columns=["full", "empty", "updated_at"],
+        )
+        conn.execute(
+            text(
+                """
+                INSERT INTO bike_station_status_sync ("id", "synced_at") VALUES (:id, :synced_at)
+                ON CONFLICT ("id") DO UPDATE SET "synced_at" = EXCLUDED."synced_at";
+                """
+            ),
+            {"id": SYNC_ROW_ID, "synced_at": synced_at},
+        )
         conn.commit()
+    state.apply(changed_df, synced_at)
+    print(f"Updated the status of {len(changed_df)} of {len(df)} stations")
 
 
 def db_update_bike_station(df: pd.DataFrame) -> None:
@@ -30,58 +49,117 @@ def db_update_bike_station(df: pd.DataFrame) -> None:
     Expects a clean_youbike_data schema
     """
     incoming_ids = df["id"].tolist()
-    with sql_utils.DB_Connection.from_env().connection as conn:
-        existing_ids = [
-            row[0] for row in conn.execute(text('SELECT "id" from bike_station;')).all()
-        ]
-    new_ids = set(incoming_ids) - set(existing_ids)
+    registry = StationRegistry.get_instance()
+    new_ids = set(incoming_ids) - registry.station_ids()
 
     if len(new_ids) > 0:
         new_stations = df[df["id"].isin(new_ids)].copy()
-        new_stations["weather_zone"] = utils.identify_weather_zone(
+        new_stations["weather_zone_id"] = WeatherZoneLocator.get_instance().nearest_zone_id(
             new_stations["lat"], new_stations["lng"]
         )
-        weather_zones = utils.get_weather_zone()
-        new_stations = pd.merge(
-            left=new_stations,
-            right=weather_zones[["id", "name"]],
-            how="left",
-            left_on="weather_zone",
-            right_on="name",
-            suffixes=["", "_weather_zone"],
-        )
         new_stations["created_at"] = datetime.today().strftime(utils.DB_TS_FORMAT)
-        new_stations.rename(
-            columns={"id_weather_zone": "weather_zone_id"}, inplace=True
+        with sql_utils.DB_Connection.from_env() as conn:
+            sql_utils.bulk_upsert_dataframe(
+                conn,
+                new_stations[
+                    [
+                        "id",
+                        "lat",
+                        "lng",
+                        "city",
+                        "name",
+                        "area",
+                        "weather_zone_id",
+                        "created_at",
+                    ]
+                ],
+                "bike_station",
+                conflict_columns=["id"],
+            )
+            conn.commit()
+        registry.invalidate()
+
+    # The bootstrap build covers the new stations too
+    if not db_bootstrap_bike_station_neighbor() and len(new_ids) > 0:
+        db_update_bike_station_neighbor(new_ids)
+
+
+_is_neighbor_table_bootstrapped = False
+
+
+def db_bootstrap_bike_station_neighbor() -> bool:
+    """
+    Full build of bike_station_neighbor when the table is empty, e.g. on the first ingestion after deploy.
+    Checked once per process. Returns whether the full build ran.
+    """
+    global _is_neighbor_table_bootstrapped
+    if _is_neighbor_table_bootstrapped:
+        return False
+    with sql_utils.DB_Connection.from_env() as conn:
+        is_empty = (
+            conn.execute(text("SELECT 1 FROM bike_station_neighbor LIMIT 1;")).first()
+            is None
         )
-        sql_insert = sql_utils.SQL_INSERT_STATEMENT_FROM_DATAFRAME(
-            new_stations[
-                [
-                    "id",
-                    "lat",
-                    "lng",
-                    "city",
-                    "name",
-                    "area",
-                    "weather_zone_id",
-                    "created_at",
-                ]
-            ],
-            "bike_station",
+    if is_empty:
+        db_update_bike_station_neighbor()
+    _is_neighbor_table_bootstrapped = True
+    return is_empty
+
+
+def db_update_bike_station_neighbor(new_ids: set[int] = None) -> None:
+    """
+    Upsert the STATION_NEIGHBOR_K nearest stations of each bike station into bike_station_neighbor.
+    With new_ids, only the stations whose neighbors changed are written: the new stations, and the ones that
+    now have a new station among their nearest. Without, every station is written.
+    """
+    stations = StationRegistry.get_instance().stations()
+    neighbors = StationNeighborIndex.get_instance().neighbor_table(stations)
+    if new_ids is not None:
+        changed_ids = neighbors.loc[
+            neighbors["station_id"].isin(new_ids) | neighbors["neighbor_id"].isin(new_ids),
+            "station_id",
+        ].unique()
+        neighbors = neighbors[neighbors["station_id"].isin(changed_ids)]
+
+    with sql_utils.DB_Connection.from_env() as conn:
+        sql_utils.bulk_upsert_dataframe(
+            conn,
+            neighbors[["station_id", "rank", "neighbor_id", "distance_km"]],
+            "bike_station_neighbor",
+            conflict_columns=["station_id", "rank"],
+            update_columns=["neighbor_id", "distance_km"],
         )
+        conn.commit()
+    print(f"Updated the neighbors of {neighbors['station_id'].nunique()} stations")
 
-        with sql_utils.DB_Connection.from_env().connection as conn:
-            conn.execute(text(sql_insert))
-            conn.commit()
+
+def db_insert_fill_rate_forecast(forecasts: pd.DataFrame) -> None:
+    """Insert forecasts into the fill_rate_forecast table. Forecasts already stored for the same run are kept.
+    Expects a db.fill_rate_forecast schema
+    """
+    forecasts["base_ts"] = forecasts["base_ts"].dt.strftime(utils.DB_TS_FORMAT)
+    forecasts["run_ts"] = forecasts["run_ts"].dt.strftime(utils.DB_TS_FORMAT)
+
+    with sql_utils.DB_Connection.from_env() as conn:
+        sql_utils.bulk_upsert_dataframe(
+            conn,
+            forecasts[["station_id", "fill_rate", "relative_ts", "base_ts", "run_ts"]],
+            "fill_rate_forecast",
+            conflict_columns=["station_id", "relative_ts", "run_ts"],
+        )
+        conn.commit()
 
 
 def get_all_valid_stations_id() -> list[int]:
     """Returns a list with all station ids present in the db.bike_station table. Currently no validity filter is checked."""
-    sql_text = 'SELECT "id" FROM bike_station;'
-    with sql_utils.DB_Connection.from_env().connection as conn:
-        res = conn.execute(text(sql_text))
-        return [r[0] for r in res.all()]
+    return sorted(StationRegistry.get_instance().station_ids())
 
 
 if __name__ == "__main__":
-    print(get_all_valid_stations_id())
+    import sys
+
+    # python -m db.main rebuild-neighbors: full rebuild of bike_station_neighbor
+    if sys.argv[1:] == ["rebuild-neighbors"]:
+        db_update_bike_station_neighbor()
+    else:
+        print(get_all_valid_stations_id())
@@ -1,6 +1,14 @@
 -- Create Tables --
 CREATE TABLE bike_station_status("id" integer PRIMARY KEY,  "full" smallint, "empty" smallint, "updated_at" timestamp (0));
+CREATE TABLE bike_station_status_sync ("id" smallint PRIMARY KEY, "synced_at" timestamp (0));
 CREATE TABLE weather_zone ("id" int PRIMARY KEY, "name" char(20), "lat" real, "lng" real);
 CREATE TABLE bike_station ("id" int PRIMARY KEY, "lat" real, "lng" real,  "city" char(20), "name" char(20), "area" char(20), "weather_zone_id" int, "created_at" timestamp);
 CREATE TABLE fill_rate_forecast("id" serial PRIMARY KEY, "station_id" int, "fill_rate" real, "relative_ts" smallint, "base_ts" timestamp, "run_ts" timestamp);
+CREATE TABLE bike_station_neighbor ("station_id" int, "rank" smallint, "neighbor_id" int, "distance_km" real, PRIMARY KEY ("station_id", "rank"));
+CREATE TABLE lease ("key" varchar PRIMARY KEY, "holder" varchar, "expires_at" timestamptz);
 ALTER TABLE fill_rate_forecast ADD CONSTRAINT unique_station_time UNIQUE ("station_id", "relative_ts", "run_ts");
+
+-- Create Indexes --
+CREATE INDEX fill_rate_forecast_station_run_idx ON fill_rate_forecast ("station_id", "run_ts" DESC, "relative_ts");
+CREATE INDEX fill_rate_forecast_run_ts_idx ON fill_rate_forecast ("run_ts");
+CREATE INDEX bike_station_status_updated_at_idx ON bike_station_status ("updated_at");
@@ -1,38 +1,66 @@
 from etl.extraction import youbike
 import unittest
-from unittest.mock import Mock, patch
+from io import BytesIO
+from unittest.mock import MagicMock, patch
 from utils.s3_helper import ConnectionToS3, download_from_bucket
 import pandas as pd
 
 
+def mock_feed_session(status_code: int, body: bytes = b"", headers: dict = None) -> MagicMock:
+    """Session whose streamed GET responds with status_code, body as the raw stream, and headers"""
+    session = MagicMock()
+    response = session.get.return_value.__enter__.return_value
+    response.status_code = status_code
+    response.raw = BytesIO(body)
+    response.headers = headers or {}
+    return session
+
+
 class TestExtraction(unittest.TestCase):
 
-    @patch("requests.request")
-    def test_get_youbike_data_success(self, mock_request):
+    @patch("etl.extraction.youbike._get_session")
+    def test_get_youbike_data_success(self, mock_get_session):
         download_from_bucket(
             s3_bucket=ConnectionToS3.from_env(),
             filter=f"test/sample_youbike_valid_raw_text_response.csv",
             dest_dir="./tmp/test",
         )
-        with open(f"./tmp/test/sample_youbike_valid_raw_text_response.csv") as f:
-            res_text = f.read()
-        mock_request.return_value = Mock(status_code=200, text=res_text)
+        with open(f"./tmp/test/sample_youbike_valid_raw_text_response.csv", "rb") as f:
+            res_body = f.read()
+        mock_get_session.return_value = mock_feed_session(
+            200, res_body, {"ETag": '"abc"', "Last-Modified": "Mon, 15 Apr 2024 04:00:00 GMT"}
+        )
 
         result = youbike.get_youbike_data()
         self.assertIsInstance(result, youbike.YoubikeSnapshot)
         self.assertIsInstance(result.body, pd.DataFrame)
+        self.assertEqual(result.etag, '"abc"')
+        self.assertEqual(result.last_modified, "Mon, 15 Apr 2024 04:00:00 GMT")
 
-    @patch("requests.request")
-    def test_get_youbike_data_failure(self, mock_request):
-        mock_request.return_value = Mock(status_code=400)
+    @patch("etl.extraction.youbike._get_session")
+    def test_get_youbike_data_failure(self, mock_get_session):
+        session = mock_feed_session(400)
+        mock_get_session.return_value = session
 
         with self.assertRaises(Exception) as context:
             youbike.get_youbike_data()
 
         # General
-        mock_request.assert_called_with(
-            "GET",
+        session.get.assert_called_with(
             "https://gcs-youbike2-linebot.microprogram.tw/latest-data/youbike-station.csv",
+            headers=None,
+            stream=True,
+        )
+
+    @patch("etl.extraction.youbike._get_session")
+    def test_get_youbike_data_not_modified(self, mock_get_session):
+        session = mock_feed_session(304)
+        mock_get_session.return_value = session
+
+        result = youbike.get_youbike_data({"If-None-Match": '"abc"'})
+        self.assertIsNone(result)
+        session.get.assert_called_with(
+            youbike.URL, headers={"If-None-Match": '"abc"'}, stream=True
         )
 
 
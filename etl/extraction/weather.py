@@ -5,7 +5,7 @@ from datetime import datetime
 from retry_requests import retry
 from openmeteo_sdk.Variable import Variable
 from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
-from utils.utils import identify_weather_zone
+from utils.geo import WeatherZoneLocator
 
 
 class WeatherSnapshot:
@@ -132,7 +132,7 @@ class WeatherAPI:
         snapshot_df["lng"] = snapshot.Longitude()
 
         # Identify Weather Zone
-        snapshot_df["zone"] = identify_weather_zone(
+        snapshot_df["zone"] = WeatherZoneLocator.get_instance().nearest_zone_name(
             snapshot_df["lat"], snapshot_df["lng"]
         )
 
@@ -1,42 +1,111 @@
 import requests
+import threading
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
 from datetime import datetime
+from typing import BinaryIO
 import pytz
-from io import StringIO
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from prefect import task, flow
+from etl.transform.clean_youbike_data import RAW_SCHEMA
 
 TIMEZONE = "Asia/Taipei"
+URL = "https://gcs-youbike2-linebot.microprogram.tw/latest-data/youbike-station.csv"
+
+_ARROW_TYPES = {np.int64: pa.int64(), np.float64: pa.float64(), np.object_: pa.string()}
+# Column types of the feed, so the parser never infers them. updated_at is in unix seconds.
+FEED_COLUMN_TYPES = {
+    c: _ARROW_TYPES[t]
+    for c, t in RAW_SCHEMA.items()
+    if c not in ["last_update_ts", "extraction_ts"]
+} | {"updated_at": pa.int64()}
+
+
+FEED_RETRY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+)
+_session: requests.Session = None
+_session_lock = threading.Lock()
 
 
 class YoubikeSnapshot:
-    def __init__(self, extraction_ts: datetime, body: pd.DataFrame):
+    def __init__(
+        self,
+        extraction_ts: datetime,
+        body: pd.DataFrame,
+        etag: str = None,
+        last_modified: str = None,
+    ):
         self.extraction_ts = extraction_ts
         self.body = body
+        # HTTP validators of the response, for the next conditional request
+        self.etag = etag
+        self.last_modified = last_modified
 
 
+def _get_session() -> requests.Session:
+    """Process-level session, so connections to the feed are kept alive and failed requests retried"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount("https://", HTTPAdapter(max_retries=FEED_RETRY))
+        return _session
 
-def get_youbike_data() -> YoubikeSnapshot:
+
+
+def get_youbike_data(conditional_headers: dict = None) -> YoubikeSnapshot | None:
     """
     Returns the requested data from the youbike endpoint.
+    The response is streamed into the parser, without holding it as a decoded string.
 
         Parameters:
-            None -- Endpoint is a constant
+            conditional_headers (dict) -- If-None-Match / If-Modified-Since headers, see YoubikeFeedCheckpoint
 
         Returns:
-            YoubikeSnapshot -- Object containing the requested data
+            YoubikeSnapshot -- Object containing the requested data, None if the feed is not modified
     """
 
-    URL = "https://gcs-youbike2-linebot.microprogram.tw/latest-data/youbike-station.csv"
-    r = requests.request("GET", URL)
-    if r.status_code != 200:
-        raise Exception(f"API call to {URL} failed.")
-    tz_tst = pytz.timezone(TIMEZONE)
-    time_now = datetime.today().now(tz=tz_tst)
-    res_as_df = pd.read_csv(StringIO(r.text))
-    data = YoubikeSnapshot(extraction_ts=time_now, body=res_as_df)
+    with _get_session().get(URL, headers=conditional_headers, stream=True) as r:
+        if r.status_code == 304:
+            return None
+        if r.status_code != 200:
+            raise Exception(f"API call to {URL} failed.")
+        tz_tst = pytz.timezone(TIMEZONE)
+        time_now = datetime.today().now(tz=tz_tst)
+        # Let urllib3 undo any content encoding while streaming
+        r.raw.decode_content = True
+        res_as_df = parse_youbike_feed(r.raw)
+        data = YoubikeSnapshot(
+            extraction_ts=time_now,
+            body=res_as_df,
+            etag=r.headers.get("ETag"),
+            last_modified=r.headers.get("Last-Modified"),
+        )
     return data
 
 
+def parse_youbike_feed(feed: BinaryIO) -> pd.DataFrame:
+    """
+    Parses the youbike CSV feed with pyarrow, using FEED_COLUMN_TYPES instead of inferring dtypes.
+    updated_at is converted at parse time to last_update_ts, as datetime64[ms, Asia/Taipei].
+    """
+    table = pa_csv.read_csv(
+        feed, convert_options=pa_csv.ConvertOptions(column_types=FEED_COLUMN_TYPES)
+    )
+    last_update_ts = pc.multiply(table["updated_at"], 1000).cast(
+        pa.timestamp("ms", tz=TIMEZONE)
+    )
+    table = table.drop(["updated_at"]).append_column("last_update_ts", last_update_ts)
+    return table.to_pandas()
+
 
 def basic_preprocessing(data: YoubikeSnapshot) -> YoubikeSnapshot:
     """
@@ -50,31 +119,26 @@ def basic_preprocessing(data: YoubikeSnapshot) -> YoubikeSnapshot:
     """
 
     df = data.body
-    df["last_update_ts"] = (
-        pd.to_datetime(df["updated_at"], unit="s")
-        .dt.tz_localize(tz="UTC")
-        .dt.tz_convert(tz=TIMEZONE)
-    )
+    # last_update_ts is already typed by parse_youbike_feed
     df["extraction_ts"] = pd.to_datetime(data.extraction_ts.replace(microsecond=0)).tz_convert(tz=TIMEZONE)
-    df["last_update_ts"] = df["last_update_ts"].astype(f"datetime64[ms, {TIMEZONE}]")
     df["extraction_ts"] = df["extraction_ts"].astype(f"datetime64[ms, {TIMEZONE}]")
-
-    df.drop(labels=["updated_at"], axis=1, inplace=True)
     data.body = df
     return data
 
 
 
-def extract_youbike_raw_data() -> YoubikeSnapshot:
+def extract_youbike_raw_data(conditional_headers: dict = None) -> YoubikeSnapshot | None:
     """
     Retrieve Youbike snapshot from endpoint, preprocess it and persist it.
 
         Parameters:
-            None
+            conditional_headers (dict) -- Optional, see get_youbike_data
 
         Returns:
-            YouBikeSnapshot -- Object with the extracted data and metadata
+            YouBikeSnapshot -- Object with the extracted data and metadata, None if the feed is not modified
     """
-    data = get_youbike_data()
+    data = get_youbike_data(conditional_headers)
+    if data is None:
+        return None
     preprocessed_data = basic_preprocessing(data)
     return preprocessed_data
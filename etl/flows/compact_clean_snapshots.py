@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+from prefect import flow, task
+from prefect.deployments import Deployment
+from utils.s3_helper import ConnectionToS3, export_file_to_s3, read_parquet_objects
+from utils.snapshot_manifest import SnapshotManifest
+from utils.snapshot_compaction import (
+    compact_snapshots,
+    compacted_key,
+    day_ts_range,
+    list_compacted_days,
+    today,
+)
+
+
+@task(log_prints=True)
+def compact_snapshot_day(day: date, snapshot_keys: list[str]) -> str:
+    """Merge the clean snapshots of one day into its compacted partition."""
+    s3 = ConnectionToS3.from_env()
+    body = compact_snapshots(read_parquet_objects(s3, snapshot_keys))
+    upload_uri = export_file_to_s3(
+        connection=s3, file_name=compacted_key(day), body=body
+    )
+    print(f"Compacted {len(snapshot_keys)} snapshots of {day} at: ", upload_uri)
+    return upload_uri
+
+
+@flow(log_prints=True)
+def compact_clean_snapshots():
+    """
+    Compact every past day of clean_data/ snapshots that has no compacted partition yet.
+    The current day is left to the 10 minutes snapshots, which readers fall back to.
+    The 10 minutes snapshots are kept: the prediction features still read the latest ones.
+    """
+    s3 = ConnectionToS3.from_env()
+    manifest = SnapshotManifest.from_s3(s3)
+    if manifest.oldest_ts() is None:
+        print("No clean snapshot to compact.")
+        return
+
+    compacted_days = set(list_compacted_days(s3))
+    day = date.fromisoformat(manifest.oldest_ts()[:10])
+    while day < today():
+        snapshot_keys = manifest.keys_for_time_range(*day_ts_range(day))
+        if day not in compacted_days and len(snapshot_keys) > 0:
+            compact_snapshot_day(day, snapshot_keys)
+        day += timedelta(days=1)
+
+
+if __name__ == "__main__":
+
+    if input("Run this flow locally? [type yes]") == "yes":
+        print("Running...\n", compact_clean_snapshots())
+
+    elif input("Deploy this flow [type yes]") == "yes":
+        print("Deploying...")
+        a = Deployment.build_from_flow(
+            flow=compact_clean_snapshots,
+            output=f"flows/compact_clean_snapshots.yaml",
+            name="compact_clean_snapshots_stage",
+            work_pool_name="ecs-stage",
+            work_queue_name="default",
+            schedules=[
+                {
+                    "schedule": {
+                        "interval": 86400,
+                        "anchor_date": "2024-03-08T00:30:00+08:00",
+                        "timezone": "Asia/Taipei",
+                    },
+                    "active": True,
+                }
+            ],
+            path="/opt/prefect/flows",
+            apply=True,
+            load_existing=False,
+        )
@@ -0,0 +1,144 @@
+import os
+import pandas as pd
+from datetime import date, datetime, timedelta
+from prefect import flow, task
+from prefect.deployments import Deployment
+from sqlalchemy import text
+from utils.s3_helper import ConnectionToS3, export_file_to_s3, read_parquet_objects
+from utils.sql_utils import DB_Connection
+
+FORECAST_RETENTION_DAYS = int(os.getenv("FORECAST_RETENTION_DAYS", 7))
+DELETE_BATCH_SIZE = 10_000
+FORECAST_ARCHIVE_PREFIX = "archive/fill_rate_forecast/"
+
+
+def archive_prefix(day: date) -> str:
+    return f"{FORECAST_ARCHIVE_PREFIX}date={day:%Y-%m-%d}/"
+
+
+def archived_through(s3: ConnectionToS3, day: date) -> pd.Timestamp | None:
+    """Latest run_ts already archived for day, across its part files. None if nothing is archived."""
+    keys = [obj.key for obj in s3.Bucket.objects.filter(Prefix=archive_prefix(day))]
+    if len(keys) == 0:
+        return None
+    return max(pd.to_datetime(df["run_ts"]).max() for df in read_parquet_objects(s3, keys))
+
+
+@task(log_prints=True)
+def archive_forecast_day(day: date) -> pd.Timestamp | None:
+    """
+    Export the forecasts of one run_ts day to S3 as parquet, partitioned by date.
+    Archive objects are never overwritten: each run writes the forecasts newer than the day's existing parts
+    to a new part, named by its run_ts range. Returns the latest run_ts archived for the day, which bounds
+    what delete_forecast_day may delete.
+    """
+    s3 = ConnectionToS3.from_env()
+    through = archived_through(s3, day)
+    day_start = datetime.combine(day, datetime.min.time())
+    with DB_Connection.from_env() as conn:
+        res = conn.execute(
+            text(
+                'SELECT * FROM fill_rate_forecast WHERE "run_ts" >= :day_start AND "run_ts" < :day_end;'
+            ),
+            {
+                "day_start": day_start if through is None else through.to_pydatetime(),
+                "day_end": day_start + timedelta(days=1),
+            },
+        )
+        day_df = pd.DataFrame(res.all(), columns=list(res.keys()))
+    if through is not None:
+        day_df = day_df[pd.to_datetime(day_df["run_ts"]) > through]
+
+    if day_df.empty:
+        print(f"No new forecast of {day} to archive. Archived through: {through}")
+        return through
+    first_run_ts, last_run_ts = pd.to_datetime(day_df["run_ts"]).agg(["min", "max"])
+    upload_uri = export_file_to_s3(
+        connection=s3,
+        file_name=f"{archive_prefix(day)}fill_rate_forecast_{first_run_ts:%Y%m%dT%H%M%S}_{last_run_ts:%Y%m%dT%H%M%S}.parquet",
+        body=day_df.to_parquet(index=False),
+    )
+    print(f"Archived {len(day_df)} forecasts of {day} at: ", upload_uri)
+    return last_run_ts
+
+
+@task(log_prints=True)
+def delete_forecast_day(day: date, through: pd.Timestamp) -> int:
+    """
+    Delete the forecasts of one run_ts day up to through, the latest archived run_ts, in batches keeping each
+    transaction small. A retry after a partial delete only deletes forecasts already archived.
+    """
+    deleted = 0
+    day_start = datetime.combine(day, datetime.min.time())
+    with DB_Connection.from_env() as conn:
+        while True:
+            res = conn.execute(
+                text(
+                    'DELETE FROM fill_rate_forecast WHERE "id" IN (SELECT "id" FROM fill_rate_forecast WHERE "run_ts" >= :day_start AND "run_ts" < :day_end AND "run_ts" <= :through LIMIT :batch_size);'
+                ),
+                {
+                    "day_start": day_start,
+                    "day_end": day_start + timedelta(days=1),
+                    "through": through.to_pydatetime(),
+                    "batch_size": DELETE_BATCH_SIZE,
+                },
+            )
+            conn.commit()
+            if res.rowcount == 0:
+                break
+            deleted += res.rowcount
+    print(f"Deleted {deleted} forecasts of {day} archived through {through}")
+    return deleted
+
+
+@flow(log_prints=True)
+def fill_rate_forecast_retention(retention_days: int = FORECAST_RETENTION_DAYS):
+    """
+    Archive to S3 then delete every fill_rate_forecast day older than the retention window,
+    so the table and its indexes only hold recent runs.
+    """
+    cutoff_day = date.today() - timedelta(days=retention_days)
+    with DB_Connection.from_env() as conn:
+        oldest_run_ts = conn.execute(
+            text('SELECT min("run_ts") FROM fill_rate_forecast;')
+        ).scalar()
+
+    if oldest_run_ts is None or oldest_run_ts.date() >= cutoff_day:
+        print(f"No forecast older than {cutoff_day} to expire.")
+        return
+
+    day = oldest_run_ts.date()
+    while day < cutoff_day:
+        through = archive_forecast_day(day)
+        if through is not None:
+            delete_forecast_day(day, through)
+        day += timedelta(days=1)
+
+
+if __name__ == "__main__":
+
+    if input("Run this flow locally? [type yes]") == "yes":
+        print("Running...\n", fill_rate_forecast_retention())
+
+    elif input("Deploy this flow [type yes]") == "yes":
+        print("Deploying...")
+        a = Deployment.build_from_flow(
+            flow=fill_rate_forecast_retention,
+            output=f"flows/fill_rate_forecast_retention.yaml",
+            name="fill_rate_forecast_retention_stage",
+            work_pool_name="ecs-stage",
+            work_queue_name="default",
+            schedules=[
+                {
+                    "schedule": {
+                        "interval": 86400,
+                        "anchor_date": "2024-03-08T03:00:00+08:00",
+                        "timezone": "Asia/Taipei",
+                    },
+                    "active": True,
+                }
+            ],
+            path="/opt/prefect/flows",
+            apply=True,
+            load_existing=False,
+        )
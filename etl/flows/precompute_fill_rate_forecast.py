@@ -0,0 +1,47 @@
+from prefect import flow, task
+from prefect.deployments import Deployment
+from predict.forecast_model import FORECAST_MODEL_NAME, RegressionYouBikeModel
+from db.main import get_all_valid_stations_id, db_insert_fill_rate_forecast
+
+
+@task(log_prints=True)
+def forecast_all_stations(model_name: str = FORECAST_MODEL_NAME):
+    """Build prediction features for every valid station in one pass and forecast them."""
+    model = RegressionYouBikeModel(model_name)
+    return model.forecast(get_all_valid_stations_id())
+
+
+@task
+def task_db_insert_fill_rate_forecast(*args, **kwargs):
+    """Wrapper to @task"""
+    return db_insert_fill_rate_forecast(*args, **kwargs)
+
+
+@flow(log_prints=True)
+def precompute_fill_rate_forecast(model_name: str = FORECAST_MODEL_NAME):
+    """
+    Forecast all stations ahead of requests, so YoubikeForecastService only reads fill_rate_forecast.
+    Runs as a subflow at the end of youbike_snapshots_ingestion.
+    """
+    forecasts = forecast_all_stations(model_name)
+    task_db_insert_fill_rate_forecast(forecasts)
+    print(f"Stored {len(forecasts)} forecasts for {forecasts['station_id'].nunique()} stations")
+
+
+if __name__ == "__main__":
+
+    if input("Run this flow locally? [type yes]") == "yes":
+        print("Running...\n", precompute_fill_rate_forecast())
+
+    elif input("Deploy this flow [type yes]") == "yes":
+        print("Deploying...")
+        a = Deployment.build_from_flow(
+            flow=precompute_fill_rate_forecast,
+            output=f"flows/precompute_fill_rate_forecast.yaml",
+            name="precompute_fill_rate_forecast_stage",
+            work_pool_name="ecs-stage",
+            work_queue_name="default",
+            path="/opt/prefect/flows",
+            apply=True,
+            load_existing=False,
+        )
@@ -1,5 +1,7 @@
 from utils.utils import get_formatted_timestamp_as_str, STANDARD_TS_FORMAT
 from utils.s3_helper import ConnectionToS3, export_file_to_s3, download_from_bucket
+from utils.snapshot_manifest import register_clean_snapshot
+from utils.clean_snapshot_schema import to_storage_schema
 from etl.extraction.youbike import extract_youbike_raw_data
 from etl.transform.clean_youbike_data import clean_youbike_data
 from prefect import flow
@@ -44,13 +46,16 @@ def rerun_ingest_youbike_to_clean_layer(
         file_stub = f"youbike_dock_info_{run_ts}"
 
         clean_youbike_df = clean_youbike_data(snapshot_df)
+        clean_key = f"clean_data/{file_stub}.{file_ext}"
+        clean_body = to_storage_schema(clean_youbike_df).to_parquet(index=False)
 
         clean_upload_uri = export_file_to_s3(
             connection=s3,
-            file_name=f"clean_data/{file_stub}.{file_ext}",
-            body=clean_youbike_df.to_parquet(index=False),
+            file_name=clean_key,
+            body=clean_body,
         )
         print("Clean data uploaded at: ", clean_upload_uri)
+        register_clean_snapshot(s3, clean_key, len(clean_youbike_df), len(clean_body))
 
 
 if __name__ == "__main__":
@@ -2,9 +2,13 @@ import pandas as pd
 from prefect import flow, task
 from prefect.deployments import Deployment
 from utils import utils, s3_helper
+from utils.snapshot_manifest import register_clean_snapshot
+from utils.clean_snapshot_schema import to_storage_schema
+from utils.feed_checkpoint import YoubikeFeedCheckpoint
 from etl.extraction.youbike import extract_youbike_raw_data
 from etl.transform.clean_youbike_data import clean_youbike_data
 from db.main import db_update_bike_station_status, db_update_bike_station
+from etl.flows.precompute_fill_rate_forecast import precompute_fill_rate_forecast
 
 
 @task
@@ -13,11 +17,21 @@ def task_db_update_bike_station(*args, **kwargs):
     return db_update_bike_station(*args, **kwargs)
 
 
+@task
+def task_db_update_bike_station_status(*args, **kwargs):
+    """Wrapper to @task"""
+    return db_update_bike_station_status(*args, **kwargs)
+
+
 @flow(log_prints=True)
 def youbike_snapshots_ingestion():
     """ """
     s3_co = s3_helper.ConnectionToS3.from_env()
-    youbike_snapshot = extract_youbike_raw_data()
+    feed_checkpoint = YoubikeFeedCheckpoint.from_s3(s3_co)
+    youbike_snapshot = extract_youbike_raw_data(feed_checkpoint.conditional_headers())
+    if youbike_snapshot is None:
+        print("YouBike feed not modified since the last snapshot. Nothing to ingest.")
+        return
 
     run_ts = utils.get_formatted_timestamp_as_str(youbike_snapshot.extraction_ts)
     file_stub = f"youbike_dock_info_{run_ts}"
@@ -31,13 +45,28 @@ def youbike_snapshots_ingestion():
     print("Raw data uploded to: ", raw_upload_uri)
 
     clean_youbike_df = clean_youbike_data(youbike_snapshot.body)
+    clean_key = f"clean_data/{file_stub}.{file_ext}"
+    # Station names are stored in db.bike_station only
+    clean_body = to_storage_schema(clean_youbike_df).to_parquet(index=False)
     clean_upload_uri = s3_helper.export_file_to_s3(
         connection=s3_co,
-        file_name=f"clean_data/{file_stub}.{file_ext}",
-        body=clean_youbike_df.to_parquet(index=False),
+        file_name=clean_key,
+        body=clean_body,
     )
     print("Clean data uploaded at: ", clean_upload_uri)
+    register_clean_snapshot(s3_co, clean_key, len(clean_youbike_df), len(clean_body))
     task_db_update_bike_station(clean_youbike_df)
+    # Given the full snapshot: only changed stations are written, the rest are confirmed by the sync timestamp
+    task_db_update_bike_station_status(clean_youbike_df.copy())
+    feed_checkpoint.update(youbike_snapshot.etag, youbike_snapshot.last_modified)
+    feed_checkpoint.persist()
+
+    # Forecast failures must not fail the ingestion. A flow returning None takes its final state from its
+    # tasks and subflows, so the failed forecast state is logged and an explicit value returned instead.
+    forecast_state = precompute_fill_rate_forecast(return_state=True)
+    if forecast_state.is_failed():
+        print("Fill rate forecast precomputation failed: ", forecast_state.message)
+    return clean_upload_uri
 
 
 if __name__ == "__main__":
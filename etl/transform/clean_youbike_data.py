@@ -58,6 +58,7 @@ OUTPUT_SCHEMA = {
     "last_update_ts": pd.DatetimeTZDtype(unit="ms", tz="Asia/Taipei"),
     "extraction_ts": pd.DatetimeTZDtype(unit="ms", tz="Asia/Taipei"),
 }
+# Snapshots are stored in clean_data/ with the compact utils.clean_snapshot_schema.STORAGE_SCHEMA
 non_nullable_cols = pd.Index(
     [
         "id",
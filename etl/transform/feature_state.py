@@ -0,0 +1,136 @@
+import threading
+import numpy as np
+import pandas as pd
+
+
+class StationLagState:
+    """
+    Per-station running state of the last `window` grid slots of pct_full: a ring array of shape
+    (stations, window) plus the running sum and count of its non-null values.
+    Feeding a new snapshot costs O(stations), and so does reading the latest lag and rolling mean.
+
+    Slots are integer indices of a fixed time grid (see features_lib.LagFeatures).
+    Records older than a station's last slot are dropped before any per-slot work, so feeding the same recent
+    history again only applies the slots newer than the state. A record on the station's last slot replaces it.
+    """
+
+    _unique_instance = None
+
+    def __init__(self, window: int):
+        if StationLagState._unique_instance is not None:
+            raise Exception("This class is a singleton!")
+        self._window = window
+        self._station_index = pd.Index([], dtype=np.int64)  # row of each station id
+        self._ring = np.full((0, window), np.nan)
+        self._has_record = np.zeros((0, window), dtype=bool)
+        self._last_slot = np.full(0, -1, dtype=np.int64)
+        self._sum = np.zeros(0)
+        self._count = np.zeros(0, dtype=np.int64)
+        self._lock = threading.Lock()
+        StationLagState._unique_instance = self
+
+    @classmethod
+    def get_instance(cls, window: int):
+        if cls._unique_instance is None:
+            cls._unique_instance = cls(window)
+        return cls._unique_instance
+
+    def update(
+        self, station_ids: np.ndarray, slots: np.ndarray, values: np.ndarray
+    ) -> None:
+        """Feed records, one row per station and slot. Slots are applied in increasing order."""
+        with self._lock:
+            rows = self.__rows_for(station_ids)
+            is_recent = slots >= self._last_slot[rows]
+            rows, slots, values = rows[is_recent], slots[is_recent], values[is_recent]
+            for slot in np.unique(slots):
+                in_slot = slots == slot
+                # Keep the last record of a station when a slot holds duplicates
+                slot_rows, last_i = np.unique(rows[in_slot][::-1], return_index=True)
+                slot_values = values[in_slot][::-1][last_i]
+                self.__apply_slot(slot, slot_rows, slot_values)
+
+    def latest_features(
+        self,
+        station_ids: np.ndarray,
+        slot: int,
+        lag_slots: int,
+        lag_tolerance_slots: int,
+        min_periods: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the lagged value and the rolling mean at `slot` for each station.
+        The lag falls back to up to lag_tolerance_slots earlier slots when the lagged one has no record.
+        Stations whose last update is not `slot` get NaN.
+        """
+        with self._lock:
+            rows = self.__rows_for(station_ids)
+            is_current = self._last_slot[rows] == slot
+
+            lag = np.full(len(rows), np.nan)
+            is_found = np.zeros(len(rows), dtype=bool)
+            for k in range(lag_slots, lag_slots + lag_tolerance_slots + 1):
+                if k >= self._window:
+                    break
+                col = (slot - k) % self._window
+                sel = ~is_found & self._has_record[rows, col]
+                lag[sel] = self._ring[rows[sel], col]
+                is_found |= sel
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                window_mean = self._sum[rows] / self._count[rows]
+            window_mean[self._count[rows] < min_periods] = np.nan
+
+            lag[~is_current] = np.nan
+            window_mean[~is_current] = np.nan
+            return lag, window_mean
+
+    def __rows_for(self, station_ids: np.ndarray) -> np.ndarray:
+        rows = self._station_index.get_indexer(station_ids)
+        is_new = rows == -1
+        if is_new.any():
+            new_ids = pd.unique(station_ids[is_new])
+            n = len(new_ids)
+            self._station_index = self._station_index.append(pd.Index(new_ids, dtype=np.int64))
+            self._ring = np.vstack([self._ring, np.full((n, self._window), np.nan)])
+            self._has_record = np.vstack(
+                [self._has_record, np.zeros((n, self._window), dtype=bool)]
+            )
+            self._last_slot = np.concatenate([self._last_slot, np.full(n, -1, dtype=np.int64)])
+            self._sum = np.concatenate([self._sum, np.zeros(n)])
+            self._count = np.concatenate([self._count, np.zeros(n, dtype=np.int64)])
+            rows = self._station_index.get_indexer(station_ids)
+        return rows.astype(np.int64)
+
+    def __apply_slot(self, slot: int, rows: np.ndarray, values: np.ndarray) -> None:
+        last_slot = self._last_slot[rows]
+        is_newer = slot > last_slot
+        is_same = slot == last_slot
+
+        # Advance the ring of each station up to slot, clearing the slots it skipped
+        advance = np.where(is_newer, np.minimum(slot - last_slot, self._window), 0)
+        for k in range(1, self._window + 1):
+            sel = advance >= k
+            if not sel.any():
+                break
+            self.__evict(rows[sel], (last_slot[sel] + k) % self._window)
+        # A record on the current slot replaces the previous one
+        self.__evict(rows[is_same], np.full(is_same.sum(), slot % self._window))
+
+        to_write = is_newer | is_same
+        rows, values = rows[to_write], values[to_write]
+        col = slot % self._window
+        self._ring[rows, col] = values
+        self._has_record[rows, col] = True
+        is_value = ~np.isnan(values)
+        self._sum[rows[is_value]] += values[is_value]
+        self._count[rows[is_value]] += 1
+        self._last_slot[rows] = slot
+
+    def __evict(self, rows: np.ndarray, cols: np.ndarray) -> None:
+        evicted = self._ring[rows, cols]
+        is_value = ~np.isnan(evicted)
+        self._sum[rows[is_value]] -= evicted[is_value]
+        self._count[rows[is_value]] -= 1
+        self._ring[rows, cols] = np.nan
+        self._has_record[rows, cols] = False
@@ -7,6 +7,15 @@ from etl.transform.clean_youbike_data import clean_youbike_data
 from etl.transform import features_lib
 
 
+# Rows missing any of these are not predicted
+PREDICTION_REQUIRED_COLUMNS = [
+    "wind_speed",
+    "pct_full",
+    "30m_blag_pct_full",
+    "120m_avg_pct_full",
+]
+
+
 class FeaturesCreator(ABC):
     @abstractmethod
     def make_prediction_features(self, station_ids: list[int]) -> pd.DataFrame:
@@ -32,32 +41,39 @@ class FeaturesCreator_v1(FeaturesCreator):
     def __init__(self):
         self._model_name_version = "0.1"
         self._s3_connection = ConnectionToS3.from_env()
+        self._prediction_drop_counts: dict[str, int] = {}
 
     @property
     def model_name_version(self):
         return self._model_name_version
 
+    @property
+    def prediction_drop_counts(self) -> dict[str, int]:
+        """Rows dropped per missing required column by the last make_prediction_features call"""
+        return dict(self._prediction_drop_counts)
+
     def make_prediction_features(self, station_ids: list[int]) -> pd.DataFrame:
         # Pull input data for features
         main_df = features_lib.CreateInputPredictionFeatures("pandas").run(station_ids)
         # Create features
         main_df = features_lib.StationOccupancyFeatures("pandas").run(main_df)
+        # Keeps the latest snapshot only, lag features come from the per-station running state
+        main_df = features_lib.IncrementalLagFeatures("pandas").run(main_df)
         main_df = features_lib.TimeFeatures("pandas").run(main_df)
-        main_df = features_lib.LagFeatures("pandas").run(main_df)
 
-        # Remove records for features creation
-        main_df = main_df[main_df["extraction_ts"] == main_df["extraction_ts"].max()]
-
-        # >>>>>>>>
         # TEMP HOTFIX see https://www.notion.so/justinwarambourg/Setup-new-Bike-Station-flow-4e592b533f9c48afa359c8b21fcc5228?pvs=4
-        main_df = main_df[~main_df["wind_speed"].isna()].copy(deep=True)
         # TEMP HOTFIX - See https://www.notion.so/justinwarambourg/Review-conditions-for-valid-Youbike-record-7173f198f387442da15185201da6551f?pvs=4
+        validity_mask = features_lib.DropInvalidFeatureRows(
+            "pandas", PREDICTION_REQUIRED_COLUMNS
+        )
+        main_df = validity_mask.run(main_df)
+        self._prediction_drop_counts = validity_mask.drop_counts
+        print("prediction features dropped rows: ", self._prediction_drop_counts)
+        if len(main_df) == 0:
+            raise ValueError(
+                f"All prediction features rows were dropped: {self._prediction_drop_counts}"
+            )
 
-        main_df = main_df[~main_df["pct_full"].isna()].copy(deep=True)
-        main_df = main_df[~main_df["30m_blag_pct_full"].isna()].copy(deep=True)
-        main_df = main_df[~main_df["120m_avg_pct_full"].isna()].copy(deep=True)
-
-        # <<<<<<<<
         # Format and Validate to Schema
         main_df = features_lib.FormatToFeaturesSchema("pandas").run(main_df)
         is_schema_valid = features_lib.ValidateFeaturesSchema("pandas").run(main_df)
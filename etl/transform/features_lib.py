@@ -2,29 +2,45 @@ import pyspark
 import pandas as pd
 import numpy as np
 from typing import Union
+from datetime import date
+from functools import reduce
 from abc import ABC, abstractmethod
 from pyspark.sql.functions import (
     month,
     dayofweek,
     hour,
-    from_unixtime,
     lead,
-    date_format,
+    floor,
     isnan,
-    lag,
     mean,
+    col,
+    count,
+    last,
+    when,
+    round as spark_round,
+    broadcast,
 )
 from utils.utils import (
-    get_youbike_snapshot_data_for_time_range,
+    STANDARD_TS_FORMAT,
     get_weather_zone,
     get_latest_weather_data,
-    DB_Connection,
 )
 from pyspark.sql.window import Window
+from utils.snapshot_cache import RecentSnapshotWindow
+from utils.station_registry import StationRegistry
+from utils.snapshot_manifest import SnapshotManifest, UNKNOWN_SCHEMA_VERSION
+from utils.clean_snapshot_schema import SPARK_STORAGE_SCHEMA, STORAGE_SCHEMA
+from utils.s3_helper import ConnectionToS3
+from utils.snapshot_compaction import (
+    COMPACTED_SNAPSHOT_PREFIX,
+    list_compacted_days,
+    to_snapshot_timezone,
+)
 from db.main import get_all_valid_stations_id
 from api import get_bike_station_status
 import os
 from etl.transform.spark_app import SparkApp
+from etl.transform.feature_state import StationLagState
 from sqlalchemy import text
 
 
@@ -96,35 +112,293 @@ class StationOccupancyFeatures(DataTransformer):
         return df
 
 
+SNAPSHOT_INTERVAL_MINUTES = 10
+LAG_SLOTS = 3  # 30 minutes
+LAG_TOLERANCE_SLOTS = 1  # fall back to the previous snapshot if the lagged one is missing
+ROLLING_SLOTS = 12  # 120 minutes
+ROLLING_MIN_PERIODS = 9  # tolerate up to 3 missing snapshots in the 120 minutes window
+
+
 class LagFeatures(DataTransformer):
+    """
+    Lag and rolling features computed on a fixed 10 minutes grid rather than on row counts,
+    so missed or duplicated ingestion runs do not shift the features.
+    Each record is aligned to its nearest grid slot. The lag takes the latest record at most
+    LAG_TOLERANCE_SLOTS before the lagged slot (as-of). The rolling mean averages the records of
+    the last ROLLING_SLOTS slots, and is NaN with fewer than rolling_min_periods of them.
+    """
+
+    def __init__(self, exec_library, rolling_min_periods: int = ROLLING_MIN_PERIODS):
+        super().__init__(exec_library)
+        self._rolling_min_periods = rolling_min_periods
+
     def in_pandas(self, df):
+        slots = _grid_slots(df["extraction_ts"])
+        station_codes = pd.factorize(df["station_id"])[0].astype(np.int64)
+        # Slots fit in 32 bits, so one int64 key orders rows by station then time
+        keys = (station_codes << 32) + slots
+
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        pct_full = df["pct_full"].to_numpy(dtype=np.float64)[order]
+
+        # As-of lookup of the lagged slot
+        lag_i = np.searchsorted(sorted_keys, keys - LAG_SLOTS, side="right") - 1
+        found = (lag_i >= 0) & (
+            sorted_keys[np.maximum(lag_i, 0)] >= keys - LAG_SLOTS - LAG_TOLERANCE_SLOTS
+        )
+        df["30m_blag_pct_full"] = np.where(found, pct_full[np.maximum(lag_i, 0)], np.nan)
+
+        # Rolling mean over the window of slots, ignoring NaN
+        is_nan = np.isnan(pct_full)
+        cum_sum = np.concatenate([[0.0], np.cumsum(np.where(is_nan, 0.0, pct_full))])
+        cum_count = np.concatenate([[0], np.cumsum(~is_nan)])
+        lo = np.searchsorted(sorted_keys, keys - ROLLING_SLOTS + 1, side="left")
+        hi = np.searchsorted(sorted_keys, keys, side="right")
+        count = cum_count[hi] - cum_count[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            window_mean = (cum_sum[hi] - cum_sum[lo]) / count
+        df["120m_avg_pct_full"] = np.where(
+            count >= self._rolling_min_periods, window_mean, np.nan
+        )
+        return df
 
-        df["30m_blag_pct_full"] = (
-            df.sort_values(by="extraction_ts")
-            .groupby(by=["station_id"])["pct_full"]
-            .transform(lambda x: x.shift(3))  # Assumes each record is 10 mins
+    def in_pyspark(self, df):
+        df = df.withColumn(
+            "slot",
+            spark_round(
+                col("extraction_ts").cast("long") / (SNAPSHOT_INTERVAL_MINUTES * 60)
+            ).cast("long"),
         )
+        windowSpec = Window.partitionBy("station_id").orderBy("slot")
 
-        df["120m_avg_pct_full"] = (
-            df.sort_values(by="extraction_ts")
-            .groupby(by=["station_id"])["pct_full"]
-            .transform(
-                lambda x: x.rolling(window=12).mean()
-            )  # Assumes each record is 10 mins
+        df = df.withColumn(
+            "30m_blag_pct_full",
+            last("pct_full").over(
+                windowSpec.rangeBetween(-LAG_SLOTS - LAG_TOLERANCE_SLOTS, -LAG_SLOTS)
+            ),
         )
 
-        return df
+        rolling_window = windowSpec.rangeBetween(-ROLLING_SLOTS + 1, 0)
+        df = df.withColumn(
+            "120m_avg_pct_full",
+            when(
+                count("pct_full").over(rolling_window) >= self._rolling_min_periods,
+                mean("pct_full").over(rolling_window),
+            ),
+        )
+        return df.drop("slot")
+
+
+class IncrementalLagFeatures(LagFeatures):
+    """
+    Same features as LagFeatures, for the latest snapshot only, computed from the process-level
+    StationLagState. The recent history is given on every call: the state drops the records older
+    than each station's last slot in one vectorized pass, so once warm only the new snapshots are
+    applied. Returns the rows of the latest snapshot.
+    """
+
+    def in_pandas(self, df):
+        slots = _grid_slots(df["extraction_ts"])
+        station_ids = df["station_id"].to_numpy(dtype=np.int64)
+        state = StationLagState.get_instance(ROLLING_SLOTS)
+        state.update(station_ids, slots, df["pct_full"].to_numpy(dtype=np.float64))
+
+        is_latest = (df["extraction_ts"] == df["extraction_ts"].max()).to_numpy()
+        latest_df = df[is_latest].copy()
+        lag, window_mean = state.latest_features(
+            station_ids[is_latest],
+            slots[is_latest].max(),
+            LAG_SLOTS,
+            LAG_TOLERANCE_SLOTS,
+            self._rolling_min_periods,
+        )
+        latest_df["30m_blag_pct_full"] = lag
+        latest_df["120m_avg_pct_full"] = window_mean
+        return latest_df
 
     def in_pyspark(self, df):
-        windowSpec = Window.partitionBy("station_id").orderBy("extraction_ts")
+        """No implementation in pyspark"""
+        pass
 
-        df = df.withColumn("30m_blag_pct_full", lag("pct_full", 3).over(windowSpec))
 
-        # Rolling average for 120 minutes (12 periods of 10 minutes)
-        df = df.withColumn(
-            "120m_avg_pct_full", mean("pct_full").over(windowSpec.rowsBetween(-11, 0))
+def _grid_slots(extraction_ts: pd.Series) -> np.ndarray:
+    """Index of the nearest SNAPSHOT_INTERVAL_MINUTES grid slot of each timestamp"""
+    slot_ns = SNAPSHOT_INTERVAL_MINUTES * 60 * 10**9
+    epoch_ns = extraction_ts.dt.as_unit("ns").values.astype(np.int64)
+    return (epoch_ns + slot_ns // 2) // slot_ns
+
+
+HOUR_NS = 3600 * 10**9
+WEATHER_FEATURES_TABLE = "processed_data/weather/hourly_features/"
+WEATHER_FEATURE_COLUMNS = [
+    "temperature",
+    "relative_humidity",
+    "apparent_temperature",
+    "precipitation",
+    "wind_speed",
+    "1h_fwd_precipitation",
+    "1h_fwd_apparent_temperature",
+]
+
+
+def epoch_hours(ts: pd.Series) -> np.ndarray:
+    """Whole hours since epoch of each tz-aware timestamp. Integer weather join key, independent of the timezone.
+    Naive timestamps are rejected, as the instant they stand for is ambiguous (see to_snapshot_timezone)."""
+    if ts.dt.tz is None:
+        raise ValueError("epoch_hours expects tz-aware timestamps")
+    return ts.values.astype("datetime64[h]").astype(np.int64)
+
+
+def weather_lookup_table(weather_data: pd.DataFrame) -> pd.DataFrame:
+    """Weather features of each zone and hour, indexed by (weather_zone_id, epoch_hour)"""
+    return (
+        weather_data.assign(epoch_hour=epoch_hours(weather_data["datetime"]))
+        .set_index(["weather_zone_id", "epoch_hour"])[WEATHER_FEATURE_COLUMNS]
+        .sort_index()
+    )
+
+
+def read_clean_snapshots_spark(
+    spark_session: pyspark.sql.SparkSession,
+    snapshot_uris: list[str],
+    manifest: SnapshotManifest,
+    scan_filter: pyspark.sql.Column = None,
+) -> pyspark.sql.DataFrame:
+    """
+    Reads clean snapshots of mixed schema versions as SPARK_STORAGE_SCHEMA. Parquet files storing counts as int64
+    and int16 cannot be read together, so files are read per schema version from the manifest, cast, then unioned.
+    Snapshots missing from the manifest, whose version is unknown, are read one by one.
+    """
+    uris_by_version: dict[int, list[str]] = {}
+    for uri in snapshot_uris:
+        uris_by_version.setdefault(manifest.schema_version(uri), []).append(uri)
+    uri_groups = [
+        [uri] for uri in uris_by_version.pop(UNKNOWN_SCHEMA_VERSION, [])
+    ] + list(uris_by_version.values())
+
+    snapshot_dfs = [
+        _scan_as_spark_storage_schema(
+            spark_session.read.format("parquet").load(uris), scan_filter
         )
-        return df
+        for uris in uri_groups
+    ]
+    return reduce(lambda a, b: a.unionByName(b), snapshot_dfs)
+
+
+def read_youbike_history_spark(
+    spark_session: pyspark.sql.SparkSession,
+    bucket_name: str,
+    s3: ConnectionToS3,
+    oldest_ts: pd.Timestamp,
+    newest_ts: pd.Timestamp,
+    station_ids: list[int],
+) -> pyspark.sql.DataFrame:
+    """
+    Reads the clean snapshots of station_ids with oldest_ts <= extraction_ts < newest_ts as SPARK_STORAGE_SCHEMA.
+    Naive timestamps are taken as Asia/Taipei. Compacted days are read from their date partition only, other days
+    from the 10 minutes snapshots the manifest indexes in the range. The station and time filters are pushed down
+    to the parquet scans. Compacted days are sorted by time, so their row groups out of the period are skipped.
+    """
+    oldest_ts, newest_ts = to_snapshot_timezone(oldest_ts), to_snapshot_timezone(newest_ts)
+    scan_filter = (
+        col("id").isin(station_ids)
+        & (col("extraction_ts") >= oldest_ts.to_pydatetime())
+        & (col("extraction_ts") < newest_ts.to_pydatetime())
+    )
+    manifest = SnapshotManifest.from_s3(s3)
+    compacted_days = {
+        d for d in list_compacted_days(s3) if oldest_ts.date() <= d <= newest_ts.date()
+    }
+
+    history_dfs = []
+    if len(compacted_days) > 0:
+        compacted_uri = f"s3a://{bucket_name}/{COMPACTED_SNAPSHOT_PREFIX}"
+        history_dfs.append(
+            _scan_as_spark_storage_schema(
+                spark_session.read.option("basePath", compacted_uri)
+                .format("parquet")
+                .load([f"{compacted_uri}date={d:%Y-%m-%d}/" for d in sorted(compacted_days)]),
+                scan_filter,
+            )
+        )
+
+    snapshot_keys = [
+        key
+        for key in manifest.keys_for_time_range(
+            oldest_ts.strftime(STANDARD_TS_FORMAT), newest_ts.strftime(STANDARD_TS_FORMAT)
+        )
+        if date.fromisoformat(SnapshotManifest.ts_from_key(key)[:10]) not in compacted_days
+    ]
+    if len(snapshot_keys) > 0:
+        history_dfs.append(
+            read_clean_snapshots_spark(
+                spark_session,
+                [f"s3a://{bucket_name}/{key}" for key in snapshot_keys],
+                manifest,
+                scan_filter,
+            )
+        )
+    if len(history_dfs) == 0:
+        raise ValueError(f"No clean snapshot found from {oldest_ts} to {newest_ts}")
+    return reduce(lambda a, b: a.unionByName(b), history_dfs)
+
+
+def load_weather_features_spark(
+    spark_session: pyspark.sql.SparkSession,
+    bucket_name: str,
+    weather_zone_name_df: pyspark.sql.DataFrame,
+) -> pyspark.sql.DataFrame:
+    """
+    Hourly weather features keyed by (weather_zone_id, epoch_hour), stored once in S3 at WEATHER_FEATURES_TABLE.
+    The table is only rebuilt from the historical weather reports when one of them is newer than it.
+    """
+    spark_app = SparkApp.get_instance()
+    spark_context = spark_app.spark_context
+    URI = spark_context._gateway.jvm.java.net.URI
+    Path = spark_context._gateway.jvm.org.apache.hadoop.fs.Path
+    FileSystem = spark_context._gateway.jvm.org.apache.hadoop.fs.FileSystem
+    bucket_fs = FileSystem.get(URI(f"s3a://{bucket_name}/"), spark_app.spark_hadoop_conf)
+
+    table_uri = f"s3a://{bucket_name}/{WEATHER_FEATURES_TABLE}"
+    report_statuses = bucket_fs.listStatus(
+        Path(f"s3a://{bucket_name}/raw_data/weather/historical_report")
+    )
+    latest_report_ts = max(s.getModificationTime() for s in report_statuses)
+    # S3 directories have no modification time, Spark's _SUCCESS marker does
+    table_marker = Path(f"{table_uri}_SUCCESS")
+    if (
+        bucket_fs.exists(table_marker)
+        and bucket_fs.getFileStatus(table_marker).getModificationTime() >= latest_report_ts
+    ):
+        return spark_session.read.format("parquet").load(table_uri)
+
+    print("Rebuilding the weather features table at: ", table_uri)
+    hist_weather_report = (
+        spark_session.read.format("parquet")
+        .load([s.getPath().toString() for s in report_statuses])
+        .dropDuplicates(["datetime", "zone"])
+    )
+    hist_weather_report = MakeWeatherFeatures("pyspark").run(hist_weather_report)
+    weather_features = (
+        hist_weather_report.withColumn(
+            "epoch_hour", floor(hist_weather_report.datetime / HOUR_NS)
+        )
+        .withColumnRenamed("zone", "weather_zone")
+        .join(broadcast(weather_zone_name_df), on="weather_zone")
+        .select(["weather_zone_id", "epoch_hour"] + WEATHER_FEATURE_COLUMNS)
+    )
+    weather_features.write.mode("overwrite").format("parquet").save(table_uri)
+    return spark_session.read.format("parquet").load(table_uri)
+
+
+def _scan_as_spark_storage_schema(
+    df: pyspark.sql.DataFrame, scan_filter: pyspark.sql.Column = None
+) -> pyspark.sql.DataFrame:
+    """Filters on the columns as stored, before the casts, so the filter is pushed down to the parquet scan"""
+    if scan_filter is not None:
+        df = df.filter(scan_filter)
+    return df.select([col(c).cast(t).alias(c) for c, t in SPARK_STORAGE_SCHEMA.items()])
 
 
 class TimeFeatures(DataTransformer):
@@ -143,6 +417,37 @@ class TimeFeatures(DataTransformer):
         return df
 
 
+class DropInvalidFeatureRows(DataTransformer):
+    """
+    Drops the rows with a missing value in any of required_columns, through one combined mask
+    applied once. After a pandas run, drop_counts holds the rows missing each column (a row can
+    count for several columns) and the total of rows dropped.
+    """
+
+    def __init__(self, exec_library, required_columns: list[str]):
+        super().__init__(exec_library)
+        self._required_columns = required_columns
+        self.drop_counts: dict[str, int] = {}
+
+    def in_pandas(self, df):
+        is_na = df[self._required_columns].isna().to_numpy()
+        is_invalid = is_na.any(axis=1)
+        self.drop_counts = dict(
+            zip(self._required_columns, is_na.sum(axis=0).tolist()),
+            total=int(is_invalid.sum()),
+        )
+        if self.drop_counts["total"] == 0:
+            return df
+        return df[~is_invalid]
+
+    def in_pyspark(self, df):
+        is_valid = reduce(
+            lambda a, b: a & b,
+            [col(c).isNotNull() & ~isnan(col(c)) for c in self._required_columns],
+        )
+        return df.filter(is_valid)
+
+
 class FormatToFeaturesSchema(DataTransformer):
     def __init__(self, exec_library):
         super().__init__(exec_library)
@@ -212,14 +517,20 @@ class CreateInputPredictionFeatures(DataTransformer):
     """
 
     def in_pandas(self, station_ids: list[int]):
-        # Extract latest youbike snapshot
-        youbike_latest = get_bike_station_status.get_bike_station_status(
-            extended=True
+        # Extract latest youbike snapshot, with weather zone of each station from the registry
+        youbike_latest = pd.merge(
+            left=get_bike_station_status.get_bike_station_status(extended=False),
+            right=StationRegistry.get_instance().stations()[["id", "weather_zone_id"]],
+            on="id",
         ).rename(columns={"updated_at": "extraction_ts"})
+        # bike_station_status stores naive Asia/Taipei times, while snapshots are tz-aware
+        youbike_latest["extraction_ts"] = to_snapshot_timezone(
+            youbike_latest["extraction_ts"]
+        ).astype(STORAGE_SCHEMA["extraction_ts"])
 
         # pull last 120 mins snapshot for lag features
         fresh_extraction_ts = youbike_latest["extraction_ts"][0]
-        historic_youbike_data = get_youbike_snapshot_data_for_time_range(
+        historic_youbike_data = RecentSnapshotWindow.get_instance().get_time_range(
             oldest_ts=fresh_extraction_ts - pd.Timedelta(minutes=120),
             newest_ts=fresh_extraction_ts,
         )
@@ -261,33 +572,18 @@ class CreateInputPredictionFeatures(DataTransformer):
         weather_data = get_latest_weather_data()
 
         weather_data = MakeWeatherFeatures("pandas").run(weather_data)
-        weather_data = weather_data.drop(["lat", "lng"], axis=1).rename(
-            columns={"zone": "weather_zone"}
+        weather_data = pd.merge(
+            left=weather_data.rename(columns={"zone": "weather_zone"}),
+            right=weather_zones[["weather_zone_id", "weather_zone"]],
+            on="weather_zone",
         )
-        main_df["extraction_ts"] = pd.to_datetime(main_df["extraction_ts"], utc=True)
-        print(main_df["extraction_ts"].dtype, main_df.info())
-        main_df["y_m_d_h"] = main_df["extraction_ts"].dt.strftime("%Y-%m-%d_%H")
-        weather_data["y_m_d_h"] = weather_data["datetime"].dt.strftime("%Y-%m-%d_%H")
+        weather_lookup = weather_lookup_table(weather_data)
 
-        main_df = pd.merge(
-            left=main_df,
-            right=weather_data[
-                [
-                    "temperature",
-                    "relative_humidity",
-                    "apparent_temperature",
-                    "precipitation",
-                    "wind_speed",
-                    "y_m_d_h",
-                    "weather_zone",
-                    "1h_fwd_precipitation",
-                    "1h_fwd_apparent_temperature",
-                ]
-            ],
-            on=["weather_zone", "y_m_d_h"],
-            how="left",
-        )
-        return main_df
+        main_df["weather_zone_id"] = main_df["weather_zone_id"].astype(np.int64)
+        main_df["epoch_hour"] = epoch_hours(main_df["extraction_ts"])
+
+        main_df = main_df.join(weather_lookup, on=["weather_zone_id", "epoch_hour"])
+        return main_df.drop(columns="epoch_hour")
 
     def in_pyspark(self):
         pass
@@ -303,108 +599,78 @@ class CreateInputTrainingFeatures(DataTransformer):
         station_ids: list[int],
         start_period: pd.Timestamp,
         end_period: pd.Timestamp,
+        count_rows: bool = False,
     ):
         """
         1. Get historical data for time range
         2. keep only requested stations ids
         3. Get weather zone per station, merge weather zone id to name and merge historical weather data
         4. Validate the features input schema
+
+        count_rows: count the training input, so that its load and join are timed as a stage of their own.
+        The count is an extra pass over the input, which is not cached for the caller.
         """
         spark_app = SparkApp.get_instance()
         spark_session = spark_app.spark_session
-        spark_context = spark_app.spark_context
-        URI = spark_context._gateway.jvm.java.net.URI
-        Path = spark_context._gateway.jvm.org.apache.hadoop.fs.Path
-        FileSystem = spark_context._gateway.jvm.org.apache.hadoop.fs.FileSystem
 
         bucket_name = (
             "stage-youbike" if os.environ["APP_ENV"] == "stage" else "local-youbike"
         )
-        bucket_fs = FileSystem.get(
-            URI(f"s3a://{bucket_name}/"), spark_app.spark_hadoop_conf
-        )
 
-        # Import required data
-        hist_weather_reports_uri = [
-            obj.getPath().toString()
-            for obj in bucket_fs.listStatus(
-                Path(f"s3a://{bucket_name}/raw_data/weather/historical_report")
-            )
-        ]
-        hist_weather_report = (
-            spark_session.read.option("InferSchema", True)
-            .option("header", True)
-            .format("parquet")
-            .load(hist_weather_reports_uri)
+        registry = StationRegistry.get_instance()
+        station_id_to_weather_id = spark_session.createDataFrame(
+            registry.stations()[["id", "weather_zone_id"]]
         )
-        hist_weather_report = hist_weather_report.dropDuplicates(["datetime", "zone"])
-
-        youbike_snapshot_uri = [
-            obj.getPath().toString()
-            for obj in bucket_fs.listStatus(Path(f"s3a://{bucket_name}/clean_data/"))
-        ][5000:5500]
-        hist_snapshot_df = (
-            spark_session.read.option("InferSchema", True)
-            .option("header", True)
-            .format("parquet")
-            .load(youbike_snapshot_uri)
+        weather_zone_name_df = spark_session.createDataFrame(
+            registry.weather_zones()[["id", "name"]]
         )
+        weather_zone_name_df = weather_zone_name_df.withColumnRenamed(
+            "id", "weather_zone_id"
+        ).withColumnRenamed("name", "weather_zone")
 
-        with DB_Connection.from_env().connection as conn:
-            station_id_to_weather_id = spark_session.createDataFrame(
-                pd.read_sql('SELECT "id", "weather_zone_id"  FROM bike_station;', conn)
-            )
-            weather_zone_name_df = spark_session.createDataFrame(
-                pd.read_sql('SELECT "id", "name" FROM weather_zone;', conn)
+        with spark_app.timed_stage("weather_features_table"):
+            weather_features = load_weather_features_spark(
+                spark_session, bucket_name, weather_zone_name_df
             )
 
-        # Only keep requested filters
-        hist_snapshot_df = hist_snapshot_df.filter(
-            hist_snapshot_df.id.isin(station_ids)
+        hist_snapshot_df = read_youbike_history_spark(
+            spark_session,
+            bucket_name,
+            ConnectionToS3.from_env(),
+            start_period,
+            end_period,
+            station_ids,
         )
 
-        weather_zone_name_df = weather_zone_name_df.withColumnRenamed(
-            "id", "weather_zone_id"
-        ).withColumnRenamed("name", "weather_zone")
-
+        # Dimensions are small, broadcasting them avoids shuffling the snapshots
         main_df = hist_snapshot_df.join(
-            station_id_to_weather_id, on="id", how="left"
-        ).join(weather_zone_name_df, on="weather_zone_id", how="left")
+            broadcast(station_id_to_weather_id), on="id", how="left"
+        ).join(broadcast(weather_zone_name_df), on="weather_zone_id", how="left")
 
         # Some historical stations do no longer exist, based on whether they got a weather_zone_id assigned. If not dropped
         ## Future work is to filter out all stations that do not exist anymore, or at least use them to learn by assigning them to a group
         main_df = main_df.filter(~isnan(main_df.weather_zone_id))
 
-        hist_weather_report = MakeWeatherFeatures("pyspark").run(hist_weather_report)
-        hist_weather_report = (
-            hist_weather_report.withColumn(
-                "datetime_unix", hist_weather_report.datetime / 10**9
-            )
-            .withColumn("datetime", from_unixtime("datetime_unix", "yyyy-MM-dd_HH"))
-            .withColumnRenamed("datetime", "y_m_d_h")
-            .withColumnRenamed("zone", "weather_zone")
-        )
-
         main_df = main_df.withColumn(
-            "y_m_d_h", date_format(main_df.extraction_ts, "yyyy-MM-dd_HH")
+            "epoch_hour", floor(col("extraction_ts").cast("long") / 3600)
         ).withColumnRenamed("id", "station_id")
 
+        # Only the hours of the period are broadcast
+        period_start, period_end = epoch_hours(
+            pd.Series([to_snapshot_timezone(start_period), to_snapshot_timezone(end_period)])
+        )
+        weather_features = weather_features.filter(
+            col("epoch_hour").between(int(period_start), int(period_end))
+        )
         main_df = main_df.join(
-            hist_weather_report.select(
-                [
-                    "temperature",
-                    "relative_humidity",
-                    "apparent_temperature",
-                    "precipitation",
-                    "wind_speed",
-                    "y_m_d_h",
-                    "weather_zone",
-                    "1h_fwd_precipitation",
-                    "1h_fwd_apparent_temperature",
-                ]
-            ),
-            on=["y_m_d_h", "weather_zone"],
+            broadcast(weather_features),
+            on=["weather_zone_id", "epoch_hour"],
             how="left",
-        )
+        ).drop("epoch_hour")
+
+        if count_rows:
+            with spark_app.timed_stage("load_and_join_training_input"):
+                print("Training input rows: ", main_df.count())
+        spark_app.print_stage_timings()
 
         return main_df
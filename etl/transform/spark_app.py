@@ -1,12 +1,60 @@
 from pyspark import SparkConf, SparkContext
 from pyspark.sql import SparkSession
 import os
+import time
+from contextlib import contextmanager
 from pandas import DataFrame
 
+SPARK_PROFILE = os.getenv("SPARK_PROFILE", "local-small")
+# Overrides the shuffle partitions of the profile when set
+SPARK_SHUFFLE_PARTITIONS = os.getenv("SPARK_SHUFFLE_PARTITIONS")
+
+_COMMON_PROFILE_CONF = {
+    "spark.sql.adaptive.enabled": "true",
+    "spark.sql.adaptive.coalescePartitions.enabled": "true",
+    "spark.sql.execution.arrow.pyspark.enabled": "true",
+    "spark.sql.execution.arrow.pyspark.fallback.enabled": "true",
+    "spark.hadoop.fs.s3a.fast.upload": "true",
+    "spark.hadoop.fs.s3a.fast.upload.buffer": "bytebuffer",
+}
+
+# Performance settings by SPARK_PROFILE. Local profiles run the driver as the only executor.
+SPARK_PROFILES = {
+    "local-small": {
+        **_COMMON_PROFILE_CONF,
+        "spark.master": "local[*]",
+        "spark.driver.memory": "2g",
+        "spark.sql.shuffle.partitions": "8",
+        "spark.hadoop.fs.s3a.connection.maximum": "32",
+        "spark.hadoop.fs.s3a.threads.max": "32",
+    },
+    "local-large": {
+        **_COMMON_PROFILE_CONF,
+        "spark.master": "local[*]",
+        "spark.driver.memory": "8g",
+        "spark.sql.shuffle.partitions": "32",
+        "spark.hadoop.fs.s3a.connection.maximum": "64",
+        "spark.hadoop.fs.s3a.threads.max": "64",
+    },
+    # Master and executors come from spark-submit, see docker/spark/entrypoint.sh
+    "cluster": {
+        **_COMMON_PROFILE_CONF,
+        "spark.driver.memory": "2g",
+        "spark.executor.memory": "4g",
+        "spark.sql.shuffle.partitions": "200",
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.hadoop.fs.s3a.connection.maximum": "100",
+        "spark.hadoop.fs.s3a.threads.max": "64",
+    },
+}
+
 # Fix due to pandas 2.0 and pyspark 3.3 incompatibility
 DataFrame.iteritems = DataFrame.items
 
 class SparkApp:
+    """Singleton holding the Spark context and session. Also records the wall time of named job stages, so the
+    cost of each stage can be reported without the Spark UI."""
+
     __unique_instance = None
 
     def __init__(self, log_level: str = "WARN") -> None:
@@ -16,10 +64,12 @@ class SparkApp:
             )
 
         self.spark_conf = self.__get_spark_config()
-        self.spark_context = SparkContext(conf=self.__get_spark_config())
+        self.spark_context = SparkContext(conf=self.spark_conf)
         self.spark_context.setLogLevel(log_level)
+        self.__print_effective_config()
         self.spark_hadoop_conf = self.spark_context._jsc.hadoopConfiguration()
         self.__spark_session = SparkSession.builder.getOrCreate()
+        self._stage_timings: dict[str, float] = {}
 
         SparkApp.__unique_instance = self
 
@@ -34,8 +84,42 @@ class SparkApp:
             cls.__unique_instance = cls(log_level)
         return cls.__unique_instance
 
+    @contextmanager
+    def timed_stage(self, name: str):
+        """Adds the wall time of the block to the stage timings. Spark being lazy, a stage only includes the
+        work of the DataFrames it runs an action on."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._stage_timings[name] = (
+                self._stage_timings.get(name, 0.0) + time.perf_counter() - start
+            )
+
+    def stage_timings(self) -> dict[str, float]:
+        """Seconds spent in each stage since the app started, in execution order"""
+        return dict(self._stage_timings)
+
+    def print_stage_timings(self) -> None:
+        for name, seconds in self._stage_timings.items():
+            print(f"{name:<30} {seconds:>9.3f}s")
+
+    def __print_effective_config(self) -> None:
+        print(f"SparkApp: running with SPARK_PROFILE={SPARK_PROFILE}")
+        for key, value in sorted(self.spark_context.getConf().getAll()):
+            if "secret" in key or "access.key" in key:
+                value = "***"
+            print(f"  {key}={value}")
+
     def __get_spark_config(self) -> SparkConf:
         _spark_conf = SparkConf()
+        if SPARK_PROFILE not in SPARK_PROFILES:
+            raise ValueError(
+                f"Unknown SPARK_PROFILE {SPARK_PROFILE}, expected one of {list(SPARK_PROFILES)}"
+            )
+        _spark_conf.setAll(SPARK_PROFILES[SPARK_PROFILE].items())
+        if SPARK_SHUFFLE_PARTITIONS is not None:
+            _spark_conf.set("spark.sql.shuffle.partitions", SPARK_SHUFFLE_PARTITIONS)
 
         if os.environ["APP_ENV"] == "stage":
             accessKeyId = os.environ["AWS_ACCESS_KEY_ID"]
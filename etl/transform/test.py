@@ -0,0 +1,199 @@
+from etl.transform import features_lib
+from etl.transform.features_creator import FeaturesCreator_v1
+from etl.transform.feature_state import StationLagState
+from utils.clean_snapshot_schema import STORAGE_SCHEMA
+from utils.utils import STANDARD_TS_FORMAT
+import unittest
+from unittest.mock import Mock, patch
+import numpy as np
+import pandas as pd
+
+N_STATIONS = 50
+N_HISTORY_SNAPSHOTS = 12
+# bike_station_status.updated_at: naive Asia/Taipei time of the latest snapshot
+LATEST_STATUS_TS = pd.Timestamp("2024-04-15 12:00:07")
+WEATHER_ZONES = pd.DataFrame(
+    {"id": [1, 2], "name": ["Zone A", "Zone B"], "lat": [25.0, 25.1], "lng": [121.5, 121.6]}
+)
+
+
+def make_station_status() -> pd.DataFrame:
+    """get_bike_station_status output, as read from the db"""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "id": np.arange(1, N_STATIONS + 1),
+            "full": rng.integers(0, 20, N_STATIONS),
+            "empty": rng.integers(1, 20, N_STATIONS),
+            "updated_at": LATEST_STATUS_TS.to_pydatetime(),
+            "changed_at": LATEST_STATUS_TS.to_pydatetime(),
+        }
+    )
+
+
+def make_history(oldest_ts: pd.Timestamp, newest_ts: pd.Timestamp) -> pd.DataFrame:
+    """RecentSnapshotWindow output: the 10 minutes snapshots of the range, in STORAGE_SCHEMA, newest first"""
+    rng = np.random.default_rng(1)
+    latest_ts = LATEST_STATUS_TS.tz_localize("Asia/Taipei")
+    snapshots = []
+    for k in range(1, N_HISTORY_SNAPSHOTS + 1):
+        ts = latest_ts - pd.Timedelta(minutes=10 * k) + pd.Timedelta(seconds=int(rng.integers(-20, 20)))
+        # Compared as formatted, like RecentSnapshotWindow does
+        formatted_ts = ts.strftime(STANDARD_TS_FORMAT)
+        if not oldest_ts.strftime(STANDARD_TS_FORMAT) <= formatted_ts < newest_ts.strftime(STANDARD_TS_FORMAT):
+            continue
+        snapshots.append(
+            pd.DataFrame(
+                {
+                    "id": np.arange(1, N_STATIONS + 1),
+                    "lat": 25.0,
+                    "lng": 121.5,
+                    "space": 40,
+                    "full": rng.integers(0, 20, N_STATIONS),
+                    "empty": rng.integers(1, 20, N_STATIONS),
+                    "bike_yb2": 0,
+                    "bike_eyb": 0,
+                    "city": "N/A",
+                    "area": "N/A",
+                    "last_update_ts": ts,
+                    "extraction_ts": ts,
+                }
+            ).astype(STORAGE_SCHEMA)
+        )
+    return pd.concat(snapshots, ignore_index=True)
+
+
+def make_weather_report() -> pd.DataFrame:
+    """Hourly weather forecast report. apparent_temperature is the Asia/Taipei hour of the row, to check the join."""
+    hours = pd.date_range("2024-04-15 00:00", periods=24, freq="h", tz="Asia/Taipei")
+    report = pd.concat(
+        [pd.DataFrame({"datetime": hours, "zone": zone}) for zone in WEATHER_ZONES["name"]],
+        ignore_index=True,
+    )
+    hour_of_day = report["datetime"].dt.hour.astype(np.float32)
+    return report.assign(
+        temperature=hour_of_day,
+        relative_humidity=np.float32(80),
+        apparent_temperature=hour_of_day,
+        precipitation=np.float32(0),
+        wind_speed=np.float32(3),
+        lat=np.float32(25.0),
+        lng=np.float32(121.5),
+    )
+
+
+def mocked_input_io():
+    """Patches every read of CreateInputPredictionFeatures with the synthetic data above"""
+    registry = Mock()
+    registry.stations.return_value = pd.DataFrame(
+        {"id": np.arange(1, N_STATIONS + 1), "weather_zone_id": np.arange(N_STATIONS) % 2 + 1}
+    )
+    window = Mock()
+    window.get_time_range.side_effect = make_history
+    return [
+        patch(
+            "api.get_bike_station_status.get_bike_station_status",
+            side_effect=lambda extended: make_station_status(),
+        ),
+        patch.object(features_lib.StationRegistry, "get_instance", return_value=registry),
+        patch.object(features_lib.RecentSnapshotWindow, "get_instance", return_value=window),
+        patch.object(features_lib, "get_weather_zone", side_effect=lambda: WEATHER_ZONES.copy()),
+        patch.object(features_lib, "get_latest_weather_data", side_effect=make_weather_report),
+    ]
+
+
+class MockedInputTestCase(unittest.TestCase):
+    def setUp(self):
+        for p in mocked_input_io():
+            p.start()
+            self.addCleanup(p.stop)
+
+
+class TestLagFeatures(MockedInputTestCase):
+
+    def test_lag_features_on_storage_schema_timestamps(self):
+        df = make_history(
+            LATEST_STATUS_TS.tz_localize("Asia/Taipei") - pd.Timedelta(hours=3),
+            LATEST_STATUS_TS.tz_localize("Asia/Taipei"),
+        ).rename(columns={"id": "station_id"})
+        self.assertEqual(df["extraction_ts"].dtype, STORAGE_SCHEMA["extraction_ts"])
+
+        df = features_lib.StationOccupancyFeatures("pandas").run(df)
+        df = features_lib.LagFeatures("pandas").run(df)
+
+        latest_df = df[df["extraction_ts"] == df["extraction_ts"].max()]
+        self.assertEqual(len(latest_df), N_STATIONS)
+        self.assertFalse(latest_df["30m_blag_pct_full"].isna().any())
+        self.assertFalse(latest_df["120m_avg_pct_full"].isna().any())
+
+    def test_input_prediction_features_align_latest_status_with_history(self):
+        df = features_lib.CreateInputPredictionFeatures("pandas").run(
+            list(range(1, N_STATIONS + 1))
+        )
+        self.assertEqual(df["extraction_ts"].dtype, STORAGE_SCHEMA["extraction_ts"])
+        slots = features_lib._grid_slots(df["extraction_ts"])
+        # The latest status is the snapshot right after the history, in the same timezone
+        self.assertEqual(
+            sorted(set(slots)), list(range(slots.min(), slots.min() + N_HISTORY_SNAPSHOTS + 1))
+        )
+        self.assertEqual(df["extraction_ts"].max(), LATEST_STATUS_TS.tz_localize("Asia/Taipei"))
+
+        df = features_lib.StationOccupancyFeatures("pandas").run(df)
+        df = features_lib.LagFeatures("pandas").run(df)
+        latest_df = df[df["extraction_ts"] == df["extraction_ts"].max()]
+        self.assertEqual(len(latest_df), N_STATIONS)
+        self.assertFalse(latest_df["30m_blag_pct_full"].isna().any())
+        self.assertFalse(latest_df["120m_avg_pct_full"].isna().any())
+
+
+class TestWeatherJoin(MockedInputTestCase):
+
+    def test_rows_join_the_weather_of_their_local_hour(self):
+        df = features_lib.CreateInputPredictionFeatures("pandas").run(
+            list(range(1, N_STATIONS + 1))
+        )
+        # make_weather_report sets apparent_temperature to the Asia/Taipei hour
+        self.assertTrue(
+            (df["apparent_temperature"] == df["extraction_ts"].dt.hour).all()
+        )
+        latest_df = df[df["extraction_ts"] == df["extraction_ts"].max()]
+        self.assertTrue((latest_df["apparent_temperature"] == LATEST_STATUS_TS.hour).all())
+
+    def test_epoch_hours_rejects_naive_timestamps(self):
+        with self.assertRaises(ValueError):
+            features_lib.epoch_hours(pd.Series([LATEST_STATUS_TS]))
+
+
+class TestPredictionFeatures(MockedInputTestCase):
+
+    def setUp(self):
+        super().setUp()
+        s3_patch = patch("etl.transform.features_creator.ConnectionToS3")
+        s3_patch.start()
+        self.addCleanup(s3_patch.stop)
+        # Start from an empty per-station lag state
+        StationLagState._unique_instance = None
+        self.addCleanup(setattr, StationLagState, "_unique_instance", None)
+
+    def test_make_prediction_features(self):
+        features_creator = FeaturesCreator_v1()
+        df = features_creator.make_prediction_features(list(range(1, N_STATIONS + 1)))
+
+        self.assertEqual(len(df), N_STATIONS)
+        self.assertEqual(features_creator.prediction_drop_counts["total"], 0)
+        self.assertFalse(df.isna().any().any())
+        self.assertEqual(
+            set(df.index.get_level_values("extraction_ts")),
+            {LATEST_STATUS_TS.tz_localize("Asia/Taipei")},
+        )
+
+    def test_make_prediction_features_without_valid_rows(self):
+        no_weather = patch.object(
+            features_lib, "get_latest_weather_data", side_effect=lambda: make_weather_report().iloc[:0]
+        )
+        with no_weather, self.assertRaises(ValueError):
+            FeaturesCreator_v1().make_prediction_features(list(range(1, N_STATIONS + 1)))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -7,6 +7,9 @@ import pickle
 from sklearn.linear_model import LinearRegression
 from db.main import get_all_valid_stations_id
 
+# Model serving forecasts, both precomputed after each ingestion and refreshed on request
+FORECAST_MODEL_NAME = "model_2024-03-29"
+
 
 class ForecastModel(ABC):
     """Abstract Forecaster class that provides an interface to forecast youbike demand."""
@@ -147,6 +150,6 @@ if __name__ == "__main__":
     ]
     test_station_ids = get_all_valid_stations_id()
     print(
-        RegressionYouBikeModel(model_name="model_2024-03-29").forecast(test_station_ids)
+        RegressionYouBikeModel(model_name=FORECAST_MODEL_NAME).forecast(test_station_ids)
     )
     # print(RegressionYouBikeModel().model)
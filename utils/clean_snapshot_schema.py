@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from etl.transform.youbike_mapping import YOUBIKE_AREA_MAPPING, YOUBIKE_CITY_MAPPING
+
+# Version 1: clean_youbike_data.OUTPUT_SCHEMA as is. Version 2: STORAGE_SCHEMA.
+CLEAN_SNAPSHOT_SCHEMA_VERSION = 2
+
+# Fixed categories, so snapshots concatenated together keep the categorical dtype
+CITY_DTYPE = pd.CategoricalDtype(
+    sorted(set(YOUBIKE_CITY_MAPPING.values()) | {"N/A"})
+)
+AREA_DTYPE = pd.CategoricalDtype(
+    sorted(set(YOUBIKE_AREA_MAPPING.values()) | {"N/A"})
+)
+
+STORAGE_SCHEMA = {
+    "id": np.int32,
+    "lat": np.float64,
+    "lng": np.float64,
+    "space": np.int16,
+    "full": np.int16,
+    "empty": np.int16,
+    "bike_yb2": np.int16,
+    "bike_eyb": np.int16,
+    "city": CITY_DTYPE,
+    "area": AREA_DTYPE,
+    "last_update_ts": pd.DatetimeTZDtype(unit="ms", tz="Asia/Taipei"),
+    "extraction_ts": pd.DatetimeTZDtype(unit="ms", tz="Asia/Taipei"),
+}
+
+# Same schema for pyspark, which has no categorical type. Station names are only kept in db.bike_station.
+SPARK_STORAGE_SCHEMA = {
+    "id": "int",
+    "lat": "double",
+    "lng": "double",
+    "space": "short",
+    "full": "short",
+    "empty": "short",
+    "bike_yb2": "short",
+    "bike_eyb": "short",
+    "city": "string",
+    "area": "string",
+    "last_update_ts": "timestamp",
+    "extraction_ts": "timestamp",
+}
+
+
+def to_storage_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts a clean youbike snapshot to STORAGE_SCHEMA, dropping the station name.
+    Accepts both the clean_youbike_data output and snapshots read from clean_data/ of any schema version,
+    so it is applied before writing and after reading.
+    """
+    return df[list(STORAGE_SCHEMA.keys())].astype(STORAGE_SCHEMA)
+
+
+def schema_version_of(schema: pa.Schema) -> int:
+    """Schema version of a clean snapshot from its parquet schema: version 1 stored the counts as int64,
+    STORAGE_SCHEMA stores them as int16."""
+    return CLEAN_SNAPSHOT_SCHEMA_VERSION if schema.field("full").type == pa.int16() else 1
@@ -0,0 +1,56 @@
+import json
+from utils.s3_helper import ConnectionToS3, export_file_to_s3
+
+CHECKPOINT_KEY = "metadata/youbike_feed_checkpoint.json"
+
+
+class YoubikeFeedCheckpoint:
+    """HTTP validators of the last YouBike feed response, persisted in the bucket so the next ingestion run
+    can make a conditional request, and skip the run when the feed is not modified.
+
+    Available class method:
+        from_s3(): load the checkpoint persisted in the bucket, or an empty one if absent
+    """
+
+    def __init__(
+        self,
+        connection: ConnectionToS3,
+        etag: str = None,
+        last_modified: str = None,
+    ):
+        self._connection = connection
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @classmethod
+    def from_s3(cls, connection: ConnectionToS3):
+        try:
+            s3_res = connection.Bucket.Object(CHECKPOINT_KEY).get()
+        except connection.resource.meta.client.exceptions.NoSuchKey:
+            print(f"No feed checkpoint found at {CHECKPOINT_KEY}. Starting from an empty one.")
+            return cls(connection)
+        validators = json.loads(s3_res["Body"].read())
+        return cls(
+            connection,
+            etag=validators.get("etag"),
+            last_modified=validators.get("last_modified"),
+        )
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def update(self, etag: str = None, last_modified: str = None) -> None:
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def persist(self) -> str:
+        return export_file_to_s3(
+            connection=self._connection,
+            file_name=CHECKPOINT_KEY,
+            body=json.dumps({"etag": self.etag, "last_modified": self.last_modified}),
+        )
@@ -0,0 +1,169 @@
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+from utils.station_registry import StationRegistry
+
+EARTH_RADIUS_KM = 6371.0088
+# Below this many zones, a broadcasted distance matrix is faster than querying a tree
+BALL_TREE_MIN_ZONES = 64
+
+
+def haversine_km(
+    lat1: np.ndarray, lng1: np.ndarray, lat2: np.ndarray, lng2: np.ndarray
+) -> np.ndarray:
+    """Great-circle distance in km between points given in degrees. Inputs broadcast against each other."""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class WeatherZoneLocator:
+    """
+    Assigns points to their nearest weather zone centroid by haversine distance.
+    Centroids are read once from the weather zones given. The shared instance is built from the StationRegistry
+    and rebuilt only when the registry reloads.
+    """
+
+    _unique_instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, weather_zones: pd.DataFrame, registry_version: int = None):
+        """weather_zones: db.weather_zone schema, with id, name, lat, lng"""
+        self._zone_ids = weather_zones["id"].to_numpy()
+        self._zone_names = weather_zones["name"].to_numpy()
+        self._zone_lat = weather_zones["lat"].to_numpy(dtype=np.float64)
+        self._zone_lng = weather_zones["lng"].to_numpy(dtype=np.float64)
+        self._tree = None
+        if len(weather_zones) >= BALL_TREE_MIN_ZONES:
+            self._tree = BallTree(
+                np.radians(np.column_stack([self._zone_lat, self._zone_lng])),
+                metric="haversine",
+            )
+        self.registry_version = registry_version
+
+    @classmethod
+    def get_instance(cls):
+        registry = StationRegistry.get_instance()
+        weather_zones = registry.weather_zones()
+        with cls._lock:
+            if (
+                cls._unique_instance is None
+                or cls._unique_instance.registry_version != registry.version
+            ):
+                cls._unique_instance = cls(weather_zones, registry.version)
+            return cls._unique_instance
+
+    def nearest_zone_index(self, lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+        """Position of the nearest zone of each point, in the weather zones given at init"""
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        if self._tree is not None:
+            return self._tree.query(
+                np.radians(np.column_stack([lat, lng])), k=1, return_distance=False
+            )[:, 0]
+        distances = haversine_km(
+            lat[:, None], lng[:, None], self._zone_lat[None, :], self._zone_lng[None, :]
+        )
+        return distances.argmin(axis=1)
+
+    def nearest_zone_id(self, lat: pd.Series, lng: pd.Series) -> pd.Series:
+        return pd.Series(
+            self._zone_ids[self.nearest_zone_index(lat, lng)], index=lat.index
+        )
+
+    def nearest_zone_name(self, lat: pd.Series, lng: pd.Series) -> pd.Series:
+        return pd.Series(
+            self._zone_names[self.nearest_zone_index(lat, lng)], index=lat.index
+        )
+
+
+STATION_NEIGHBOR_K = 10
+
+
+class StationNeighborIndex:
+    """
+    BallTree over the bike_station coordinates, for k-nearest and radius queries in O(log n) per point.
+    The shared instance is built from the StationRegistry and rebuilt only when the registry reloads,
+    e.g. after db_update_bike_station inserts stations.
+    """
+
+    _unique_instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, stations: pd.DataFrame, registry_version: int = None):
+        """stations: db.bike_station schema, with id, lat, lng. Stations without coordinates are left out."""
+        stations = stations.dropna(subset=["lat", "lng"])
+        self._station_ids = stations["id"].to_numpy()
+        self._tree = BallTree(
+            np.radians(stations[["lat", "lng"]].to_numpy(dtype=np.float64)),
+            metric="haversine",
+        )
+        self.registry_version = registry_version
+
+    @classmethod
+    def get_instance(cls):
+        registry = StationRegistry.get_instance()
+        stations = registry.stations()
+        with cls._lock:
+            if (
+                cls._unique_instance is None
+                or cls._unique_instance.registry_version != registry.version
+            ):
+                cls._unique_instance = cls(stations, registry.version)
+            return cls._unique_instance
+
+    def __len__(self) -> int:
+        return len(self._station_ids)
+
+    def k_nearest(
+        self, lat: np.ndarray, lng: np.ndarray, k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Ids and distances in km of the k nearest stations of each point, nearest first. Shape (points, k)"""
+        distances, positions = self._tree.query(
+            _to_radians(lat, lng), k=min(k, len(self))
+        )
+        return self._station_ids[positions], distances * EARTH_RADIUS_KM
+
+    def within_radius(
+        self, lat: np.ndarray, lng: np.ndarray, radius_km: float
+    ) -> list[np.ndarray]:
+        """Ids of the stations within radius_km of each point, nearest first"""
+        positions, _ = self._tree.query_radius(
+            _to_radians(lat, lng),
+            r=radius_km / EARTH_RADIUS_KM,
+            return_distance=True,
+            sort_results=True,
+        )
+        return [self._station_ids[p] for p in positions]
+
+    def neighbor_table(self, stations: pd.DataFrame, k: int = STATION_NEIGHBOR_K) -> pd.DataFrame:
+        """
+        Rows of db.bike_station_neighbor for the given stations (id, lat, lng): their k nearest other stations
+        with station_id, neighbor_id, rank (1 is the nearest) and distance_km.
+        """
+        neighbor_ids, distances = self.k_nearest(stations["lat"], stations["lng"], k + 1)
+        station_ids = stations["id"].to_numpy()
+        # Drop the station itself, by id since stations can share coordinates
+        is_other = neighbor_ids != station_ids[:, None]
+        rank = np.cumsum(is_other, axis=1)
+        keep = is_other & (rank <= k)
+        return pd.DataFrame(
+            {
+                "station_id": np.broadcast_to(station_ids[:, None], neighbor_ids.shape)[keep],
+                "neighbor_id": neighbor_ids[keep],
+                "rank": rank[keep],
+                "distance_km": distances[keep],
+            }
+        )
+
+
+def _to_radians(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    return np.radians(
+        np.column_stack(
+            [np.asarray(lat, dtype=np.float64), np.asarray(lng, dtype=np.float64)]
+        )
+    )
@@ -1,6 +1,13 @@
 import boto3
+from botocore.config import Config
+import io
 import os
 import pandas as pd
+import pyarrow.parquet as pq
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+S3_FETCH_CONCURRENCY = int(os.getenv("S3_FETCH_CONCURRENCY", 16))
 
 
 class ConnectionToS3:
@@ -20,6 +27,8 @@ class ConnectionToS3:
         self._resource = boto3.resource(
             "s3",
             region_name=region_name,
+            # Let concurrent readers share the client without exhausting its connection pool
+            config=Config(max_pool_connections=max(S3_FETCH_CONCURRENCY, 10)),
             **kwargs
         )
         self._bucket_name = bucket_name
@@ -78,6 +87,95 @@ def download_from_bucket(s3_bucket: ConnectionToS3, filter: str, dest_dir: str =
         print(f"Downloaded {obj.key} at {local_file_path}")
     return local_file_path
 
+
+class S3ObjectReader(io.RawIOBase):
+    """Seekable read-only file over an S3 object, where each read is a ranged GET.
+    Given to pyarrow, only the parquet footer and the row groups left by the filters are downloaded."""
+
+    def __init__(self, client, bucket_name: str, key: str):
+        self._client = client
+        self._bucket_name = bucket_name
+        self._key = key
+        self._size = client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._size}[whence]
+        self._position = base + offset
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), self._size)
+        if end <= self._position:
+            return 0
+        s3_res = self._client.get_object(
+            Bucket=self._bucket_name, Key=self._key, Range=f"bytes={self._position}-{end - 1}"
+        )
+        data = s3_res["Body"].read()
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def read_parquet_objects(
+    connection: ConnectionToS3,
+    keys: list[str],
+    max_workers: int = S3_FETCH_CONCURRENCY,
+    filters: list[tuple] = None,
+) -> list[pd.DataFrame]:
+    """Download and decode parquet objects with a bounded thread pool.
+    Uses the resource's underlying client, which unlike the resource is thread-safe.
+    Without filters, each object is downloaded whole in one GET. With filters, objects are read through
+    S3ObjectReader, so the row groups whose statistics do not match the filters are never downloaded.
+
+    Return: DataFrames in the same order as keys"""
+    client = connection.resource.meta.client
+
+    def read_parquet_object(key: str) -> pd.DataFrame:
+        if filters is not None:
+            return pd.read_parquet(
+                S3ObjectReader(client, connection.bucket_name, key), filters=filters
+            )
+        s3_res = client.get_object(Bucket=connection.bucket_name, Key=key)
+        return pd.read_parquet(BytesIO(s3_res["Body"].read()))
+
+    return _map_keys(read_parquet_object, keys, max_workers)
+
+
+def read_parquet_metadata(
+    connection: ConnectionToS3,
+    keys: list[str],
+    max_workers: int = S3_FETCH_CONCURRENCY,
+) -> list[pq.FileMetaData]:
+    """Read only the footers of parquet objects, through S3ObjectReader, with a bounded thread pool.
+    Gives the schema and row count of each object without downloading its data.
+
+    Return: FileMetaData in the same order as keys"""
+    client = connection.resource.meta.client
+    return _map_keys(
+        lambda key: pq.read_metadata(S3ObjectReader(client, connection.bucket_name, key)),
+        keys,
+        max_workers,
+    )
+
+
+def _map_keys(read_object, keys: list[str], max_workers: int) -> list:
+    if max_workers <= 1 or len(keys) <= 1:
+        return [read_object(key) for key in keys]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        return list(executor.map(read_object, keys))
+
+
 if __name__ == "__main__":
     s3_co = ConnectionToS3.from_env()
 
@@ -0,0 +1,76 @@
+import threading
+import pandas as pd
+from utils.s3_helper import ConnectionToS3, read_parquet_objects
+from utils.snapshot_manifest import SnapshotManifest
+from utils.clean_snapshot_schema import to_storage_schema
+from utils.utils import STANDARD_TS_FORMAT
+
+LAG_HORIZON_MINUTES = 120
+
+
+class RecentSnapshotWindow:
+    """Process-level cache of the most recent clean youbike snapshots, keyed by extraction timestamp.
+    Snapshots older than the lag horizon are evicted. A request only goes to S3 when its time range
+    is not covered by the last synchronisation, and then only downloads the snapshots it does not hold yet.
+    """
+
+    _unique_instance = None
+
+    def __init__(self, s3: ConnectionToS3, horizon_minutes: int = LAG_HORIZON_MINUTES):
+        if RecentSnapshotWindow._unique_instance is not None:
+            raise Exception("This class is a singleton!")
+        self._s3 = s3
+        self._horizon = pd.Timedelta(minutes=horizon_minutes)
+        self._snapshots: dict[str, pd.DataFrame] = {}
+        self._synced_range: tuple[str, str] = None
+        self._lock = threading.Lock()
+        RecentSnapshotWindow._unique_instance = self
+
+    @classmethod
+    def get_instance(cls, horizon_minutes: int = LAG_HORIZON_MINUTES):
+        if cls._unique_instance is None:
+            cls._unique_instance = cls(ConnectionToS3.from_env(), horizon_minutes)
+        return cls._unique_instance
+
+    def get_time_range(
+        self, oldest_ts: pd.Timestamp, newest_ts: pd.Timestamp
+    ) -> pd.DataFrame:
+        """Same contract as utils.get_youbike_snapshot_data_for_time_range: snapshots with
+        oldest_ts <= extraction_ts < newest_ts, newest first."""
+        oldest = oldest_ts.strftime(STANDARD_TS_FORMAT)
+        newest = newest_ts.strftime(STANDARD_TS_FORMAT)
+        horizon_start = (newest_ts - self._horizon).strftime(STANDARD_TS_FORMAT)
+
+        with self._lock:
+            if not self._is_synced(oldest, newest):
+                self._fill(oldest, newest)
+            self._evict(min(oldest, horizon_start))
+            in_range = sorted(
+                (ts for ts in self._snapshots if oldest <= ts < newest), reverse=True
+            )
+            dfs = [self._snapshots[ts] for ts in in_range]
+
+        return pd.concat(dfs, ignore_index=True)
+
+    def _is_synced(self, oldest: str, newest: str) -> bool:
+        return (
+            self._synced_range is not None
+            and self._synced_range[0] <= oldest
+            and newest <= self._synced_range[1]
+        )
+
+    def _fill(self, oldest: str, newest: str) -> None:
+        keys = SnapshotManifest.from_s3(self._s3).keys_for_time_range(oldest, newest)
+        missing_keys = [
+            k for k in keys if SnapshotManifest.ts_from_key(k) not in self._snapshots
+        ]
+        print(f"RecentSnapshotWindow: fetching {len(missing_keys)} new snapshot(s)")
+        for key, df in zip(missing_keys, read_parquet_objects(self._s3, missing_keys)):
+            self._snapshots[SnapshotManifest.ts_from_key(key)] = to_storage_schema(df)
+        self._synced_range = (oldest, newest)
+
+    def _evict(self, cutoff: str) -> None:
+        for ts in [ts for ts in self._snapshots if ts < cutoff]:
+            del self._snapshots[ts]
+        if self._synced_range is not None:
+            self._synced_range = (max(self._synced_range[0], cutoff), self._synced_range[1])
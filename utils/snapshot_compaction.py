@@ -0,0 +1,67 @@
+import pandas as pd
+from datetime import date, timedelta
+from utils.s3_helper import ConnectionToS3
+from utils.clean_snapshot_schema import to_storage_schema
+
+# One parquet per day of clean snapshots, Hive-partitioned:
+#   clean_data_compacted/date=2024-04-01/youbike_dock_info_2024-04-01.parquet
+COMPACTED_SNAPSHOT_PREFIX = "clean_data_compacted/"
+COMPACTED_ROW_GROUP_SIZE = 100_000
+SNAPSHOT_TIMEZONE = "Asia/Taipei"
+
+
+def compacted_key(day: date) -> str:
+    return f"{COMPACTED_SNAPSHOT_PREFIX}date={day:%Y-%m-%d}/youbike_dock_info_{day:%Y-%m-%d}.parquet"
+
+
+def day_from_compacted_key(key: str) -> date:
+    """'clean_data_compacted/date=2024-04-01/youbike_dock_info_2024-04-01.parquet' -> date(2024, 4, 1)"""
+    return date.fromisoformat(key.split("date=")[1].split("/")[0])
+
+
+def day_ts_range(day: date) -> tuple[str, str]:
+    """Bounds of a day formatted with utils.STANDARD_TS_FORMAT, to query the SnapshotManifest"""
+    return f"{day:%Y-%m-%d}_00:00:00", f"{day + timedelta(days=1):%Y-%m-%d}_00:00:00"
+
+
+def today() -> date:
+    """Current day in the timezone of the snapshot timestamps"""
+    return pd.Timestamp.now(tz=SNAPSHOT_TIMEZONE).date()
+
+
+def to_snapshot_timezone(ts: pd.Timestamp | pd.Series) -> pd.Timestamp | pd.Series:
+    """Naive timestamps are taken as already in SNAPSHOT_TIMEZONE. Accepts a timestamp or a datetime Series."""
+    if isinstance(ts, pd.Series):
+        ts = pd.to_datetime(ts)
+        if ts.dt.tz is None:
+            return ts.dt.tz_localize(SNAPSHOT_TIMEZONE)
+        return ts.dt.tz_convert(SNAPSHOT_TIMEZONE)
+    if ts.tzinfo is None:
+        return ts.tz_localize(SNAPSHOT_TIMEZONE)
+    return ts.tz_convert(SNAPSHOT_TIMEZONE)
+
+
+def list_compacted_days(connection: ConnectionToS3) -> list[date]:
+    """Days with a compacted partition, oldest first. Lists one object per day."""
+    return sorted(
+        day_from_compacted_key(obj.key)
+        for obj in connection.Bucket.objects.filter(
+            Prefix=f"{COMPACTED_SNAPSHOT_PREFIX}date="
+        )
+    )
+
+
+def compact_snapshots(dfs: list[pd.DataFrame]) -> bytes:
+    """
+    Merges clean snapshots into one parquet body in STORAGE_SCHEMA, sorted by extraction_ts then station id.
+    Each row group then spans about COMPACTED_ROW_GROUP_SIZE / stations snapshots (~2 hours for 8000 stations),
+    and its extraction_ts statistics let readers of a shorter period skip the other row groups.
+    """
+    day_df = (
+        pd.concat([to_storage_schema(df) for df in dfs], ignore_index=True)
+        .sort_values(by=["extraction_ts", "id"])
+        .reset_index(drop=True)
+    )
+    return day_df.to_parquet(
+        index=False, row_group_size=COMPACTED_ROW_GROUP_SIZE, write_statistics=True
+    )
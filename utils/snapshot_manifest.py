@@ -0,0 +1,200 @@
+import random
+import time
+import pandas as pd
+from botocore.exceptions import ClientError
+from datetime import date, timedelta
+from io import BytesIO
+from utils.s3_helper import ConnectionToS3, read_parquet_metadata, read_parquet_objects
+from utils.clean_snapshot_schema import CLEAN_SNAPSHOT_SCHEMA_VERSION, schema_version_of
+
+CLEAN_SNAPSHOT_PREFIX = "clean_data/youbike_dock_info_"
+# One manifest object per day of snapshots:  metadata/clean_youbike_snapshot_manifest/2024-03-28.parquet
+MANIFEST_PREFIX = "metadata/clean_youbike_snapshot_manifest/"
+MANIFEST_DTYPES = {
+    "ts": object,
+    "key": object,
+    "row_count": "int64",
+    "byte_size": "int64",
+    "schema_version": "int64",
+}
+MANIFEST_WRITE_ATTEMPTS = 8
+UNKNOWN_SCHEMA_VERSION = 0
+
+
+def manifest_key(day: date) -> str:
+    return f"{MANIFEST_PREFIX}{day:%Y-%m-%d}.parquet"
+
+
+def day_from_manifest_key(key: str) -> date:
+    """'metadata/clean_youbike_snapshot_manifest/2024-03-28.parquet' -> date(2024, 3, 28)"""
+    return date.fromisoformat(key.split(MANIFEST_PREFIX)[1].split(".")[0])
+
+
+def days_between(first: date, last: date) -> list[date]:
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+class SnapshotManifest:
+    """Index of the clean youbike snapshots stored in S3, stored as one small object per day of snapshots.
+    Avoids listing the whole clean_data/ prefix each time a time range of snapshots is requested: a lookup only
+    downloads the days it spans, and registering a snapshot only rewrites the object of its day.
+
+    Each entry holds: ts (STANDARD_TS_FORMAT string taken from the key), key, row_count, byte_size,
+    schema_version (see utils.clean_snapshot_schema).
+
+    Available class method:
+        from_s3(): open the manifest persisted in the bucket, or rebuild it from a listing if absent
+    """
+
+    def __init__(self, connection: ConnectionToS3):
+        self._connection = connection
+        self._days: dict[date, pd.DataFrame] = {}
+
+    @classmethod
+    def from_s3(cls, connection: ConnectionToS3):
+        if oldest_manifest_day(connection) is None:
+            print(f"No snapshot manifest found at {MANIFEST_PREFIX}. Rebuilding it...")
+            cls.rebuild(connection)
+        return cls(connection)
+
+    @classmethod
+    def rebuild(cls, connection: ConnectionToS3) -> None:
+        """Index every clean snapshot from a full listing, then write each day object. Row counts and schema
+        versions are taken from the parquet footers, read concurrently without downloading the data, so that
+        readers can still group the snapshots by schema version."""
+        listing = pd.DataFrame(
+            [
+                (obj.key, obj.size)
+                for obj in connection.Bucket.objects.filter(Prefix=f"{CLEAN_SNAPSHOT_PREFIX}2")
+            ],
+            columns=["key", "byte_size"],
+        )
+        footers = read_parquet_metadata(connection, listing["key"].tolist())
+        listing["ts"] = listing["key"].map(cls.ts_from_key)
+        listing["row_count"] = [f.num_rows for f in footers]
+        listing["schema_version"] = [schema_version_of(f.schema.to_arrow_schema()) for f in footers]
+        for day, entries in listing.groupby(listing["ts"].str[:10]):
+            update_manifest_day(connection, date.fromisoformat(day), entries)
+
+    @staticmethod
+    def ts_from_key(key: str) -> str:
+        """'clean_data/youbike_dock_info_2024-03-28_15:32:10.parquet' -> '2024-03-28_15:32:10'"""
+        return key.split(CLEAN_SNAPSHOT_PREFIX)[1].split(".")[0]
+
+    def _load_days(self, first: date, last: date) -> None:
+        """Downloads the day objects from first to last that are not loaded yet. Days without an object have no
+        snapshot. One listing, started at first, finds the existing objects."""
+        days = [d for d in days_between(first, last) if d not in self._days]
+        if len(days) == 0:
+            return
+        keys = []
+        for obj in self._connection.Bucket.objects.filter(
+            Prefix=MANIFEST_PREFIX, Marker=manifest_key(days[0] - timedelta(days=1))
+        ):
+            if obj.key > manifest_key(days[-1]):
+                break
+            if day_from_manifest_key(obj.key) in days:
+                keys.append(obj.key)
+
+        for day in days:
+            self._days[day] = pd.DataFrame(columns=list(MANIFEST_DTYPES)).astype(MANIFEST_DTYPES)
+        for key, entries in zip(keys, read_parquet_objects(self._connection, keys)):
+            self._days[day_from_manifest_key(key)] = entries
+
+    def keys_for_time_range(self, oldest_ts: str, newest_ts: str) -> list[str]:
+        """Returns the keys of snapshots with oldest_ts <= ts < newest_ts, oldest first.
+        Timestamps are formatted with utils.STANDARD_TS_FORMAT."""
+        if newest_ts <= oldest_ts:
+            return []
+        first, last = date.fromisoformat(oldest_ts[:10]), date.fromisoformat(newest_ts[:10])
+        self._load_days(first, last)
+        keys = []
+        for day in days_between(first, last):
+            entries = self._days[day]
+            lo, hi = entries["ts"].searchsorted([oldest_ts, newest_ts])
+            keys += entries["key"].iloc[lo:hi].tolist()
+        return keys
+
+    def oldest_ts(self) -> str | None:
+        day = oldest_manifest_day(self._connection)
+        if day is None:
+            return None
+        self._load_days(day, day)
+        return self._days[day]["ts"].iloc[0]
+
+    def schema_version(self, key: str) -> int:
+        """Schema version of an indexed snapshot, UNKNOWN_SCHEMA_VERSION if the key is not indexed."""
+        ts = self.ts_from_key(key)
+        day = date.fromisoformat(ts[:10])
+        self._load_days(day, day)
+        entries = self._days[day]
+        i = entries["ts"].searchsorted(ts)
+        if i < len(entries) and entries["ts"].iloc[i] == ts:
+            return int(entries["schema_version"].iloc[i])
+        return UNKNOWN_SCHEMA_VERSION
+
+
+def oldest_manifest_day(connection: ConnectionToS3) -> date | None:
+    """Day of the oldest manifest object, None if there is no manifest. Day objects are listed in key order."""
+    for obj in connection.Bucket.objects.filter(Prefix=MANIFEST_PREFIX).page_size(1).limit(1):
+        return day_from_manifest_key(obj.key)
+    return None
+
+
+def update_manifest_day(connection: ConnectionToS3, day: date, entries: pd.DataFrame) -> None:
+    """
+    Merges entries into the manifest object of their day, replacing the entries with the same ts.
+    The object is written with a conditional put on the version read (or on its absence). When another writer
+    updated the day in between, the put fails and the merge is retried on the latest version after a random backoff,
+    so concurrent registrations cannot drop each other's entries.
+    """
+    client = connection.resource.meta.client
+    key = manifest_key(day)
+    entries = entries[list(MANIFEST_DTYPES)].astype(MANIFEST_DTYPES)
+    for attempt in range(MANIFEST_WRITE_ATTEMPTS):
+        try:
+            s3_res = client.get_object(Bucket=connection.bucket_name, Key=key)
+            current = pd.read_parquet(BytesIO(s3_res["Body"].read()))
+            merged = pd.concat(
+                [current[~current["ts"].isin(entries["ts"])], entries], ignore_index=True
+            )
+            condition = {"IfMatch": s3_res["ETag"]}
+        except client.exceptions.NoSuchKey:
+            merged = entries
+            condition = {"IfNoneMatch": "*"}
+
+        body = merged.sort_values(by="ts", ignore_index=True).to_parquet(index=False)
+        try:
+            client.put_object(Bucket=connection.bucket_name, Key=key, Body=body, **condition)
+            return
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+            print(f"Snapshot manifest of {day} updated concurrently. Retrying...")
+            time.sleep(random.uniform(0, 0.1 * 2**attempt))
+    raise Exception(
+        f"Could not update the snapshot manifest of {day} after {MANIFEST_WRITE_ATTEMPTS} attempts."
+    )
+
+
+def register_clean_snapshot(
+    connection: ConnectionToS3, key: str, row_count: int, byte_size: int
+) -> None:
+    """Record a newly written clean snapshot in the manifest. To be called after each upload to clean_data/.
+    Only the manifest object of the snapshot's day is read and rewritten."""
+    # Rebuilds the manifest if there is none yet, so that the older snapshots are indexed too
+    SnapshotManifest.from_s3(connection)
+    ts = SnapshotManifest.ts_from_key(key)
+    update_manifest_day(
+        connection,
+        date.fromisoformat(ts[:10]),
+        pd.DataFrame(
+            {
+                "ts": [ts],
+                "key": [key],
+                "row_count": [row_count],
+                "byte_size": [byte_size],
+                "schema_version": [CLEAN_SNAPSHOT_SCHEMA_VERSION],
+            }
+        ),
+    )
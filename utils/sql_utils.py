@@ -1,23 +1,174 @@
 import os
-from sqlalchemy import create_engine, Connection
+import threading
+import time
+import pandas as pd
+from io import StringIO
+from sqlalchemy import create_engine, text, Connection, Engine
+
+COPY_BATCH_SIZE = 50_000
+
+POOL_CONFIG = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 5)),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+}
+
 
 class DB_Connection:
+    """Connection checked out from a process-wide pooled engine. Engines are created once per db_url
+    and reused, so warm processes do not pay a new TCP + auth handshake per query.
+
+    Usage:
+        with DB_Connection.from_env() as conn:
+            conn.execute(...)
+
+    The connection is returned to the pool when the block exits.
+    """
+
+    _engines: dict[str, Engine] = {}
+    _engines_lock = threading.Lock()
+    _metrics = {"checkouts": 0, "total_wait_s": 0.0, "max_wait_s": 0.0}
 
     def __init__(self, db_url) -> None:
-        engine = create_engine(db_url)
-        self._connection = engine.connect()
+        self._engine = self.get_engine(db_url)
+        self._connection = None
+
+    @classmethod
+    def get_engine(cls, db_url: str) -> Engine:
+        with cls._engines_lock:
+            if db_url not in cls._engines:
+                cls._engines[db_url] = create_engine(db_url, **POOL_CONFIG)
+            return cls._engines[db_url]
 
     @property
     def connection(self) -> Connection:
+        if self._connection is None:
+            start = time.perf_counter()
+            self._connection = self._engine.connect()
+            wait_s = time.perf_counter() - start
+            DB_Connection._metrics["checkouts"] += 1
+            DB_Connection._metrics["total_wait_s"] += wait_s
+            DB_Connection._metrics["max_wait_s"] = max(
+                DB_Connection._metrics["max_wait_s"], wait_s
+            )
         return self._connection
-    
+
+    def __enter__(self) -> Connection:
+        return self.connection.__enter__()
+
+    def __exit__(self, *exc_info) -> None:
+        self._connection.__exit__(*exc_info)
+        self._connection = None
+
     @classmethod
     def from_env(cls):
         return cls(os.environ["DATABASE_URL"])
-    
-    
+
+    @classmethod
+    def pool_metrics(cls) -> dict:
+        """Returns the pool state of each engine and the checkout wait times since process start."""
+        checkouts = cls._metrics["checkouts"]
+        return {
+            "pools": {
+                engine.url.render_as_string(): {
+                    "size": engine.pool.size(),
+                    "checked_out": engine.pool.checkedout(),
+                    "overflow": engine.pool.overflow(),
+                }
+                for engine in cls._engines.values()
+            },
+            "checkouts": checkouts,
+            "avg_wait_ms": 1000 * cls._metrics["total_wait_s"] / max(checkouts, 1),
+            "max_wait_ms": 1000 * cls._metrics["max_wait_s"],
+        }
+
+
 def SQL_INSERT_STATEMENT_FROM_DATAFRAME(source: str, target: str) -> "str":
     """Returns a 'INSERT INTO target VALUES (...), (...);"""
     insert_rows = [str(tuple(row.values)) for index, row in source.iterrows()]
     statement = "INSERT INTO " + target + " (" + str(', '.join([f'"{x}"' for x in source.columns])) + ") " + "VALUES " + ', '.join(insert_rows)
-    return statement + ";"
\ No newline at end of file
+    return statement + ";"
+
+
+def bulk_upsert_dataframe(
+    conn: Connection,
+    source: pd.DataFrame,
+    target: str,
+    conflict_columns: list[str],
+    update_columns: list[str] = None,
+    batch_size: int = COPY_BATCH_SIZE,
+) -> int:
+    """Streams a DataFrame into target through COPY into a session staging table, then merges it
+    with INSERT ... ON CONFLICT. Rows are sent in batches of batch_size. Values are never formatted
+    into the SQL text. The caller is responsible for committing.
+
+    update_columns: columns overwritten on conflict. If None, conflicting rows are left untouched (DO NOTHING).
+
+    Return: number of rows sent"""
+    columns = ", ".join([f'"{c}"' for c in source.columns])
+    staging = f"{target}_staging"
+    if update_columns:
+        on_conflict = "DO UPDATE SET " + ", ".join(
+            [f'"{c}" = EXCLUDED."{c}"' for c in update_columns]
+        )
+    else:
+        on_conflict = "DO NOTHING"
+    conflict_target = ", ".join([f'"{c}"' for c in conflict_columns])
+
+    if conn.dialect.name == "cockroachdb":
+        conn.exec_driver_sql("SET experimental_enable_temp_tables = 'on';")
+    conn.exec_driver_sql(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} AS SELECT {columns} FROM {target} WHERE false;"
+    )
+    cursor = conn.connection.cursor()
+    try:
+        for start in range(0, len(source), batch_size):
+            buffer = StringIO()
+            source.iloc[start : start + batch_size].to_csv(buffer, header=False, index=False)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH CSV", buffer)
+            cursor.execute(
+                f"INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging} "
+                f"ON CONFLICT ({conflict_target}) {on_conflict};"
+            )
+            cursor.execute(f"DELETE FROM {staging};")
+    finally:
+        cursor.close()
+    return len(source)
+
+
+def acquire_lease(conn: Connection, key: str, holder: str, ttl_seconds: int) -> bool:
+    """Try to take the db.lease row for key. Succeeds if the lease is free, expired or already held by holder.
+    Works as a cross-process lock on databases without advisory locks (CockroachDB)."""
+    res = conn.execute(
+        text(
+            """
+            INSERT INTO lease ("key", "holder", "expires_at")
+            VALUES (:key, :holder, now() + :ttl_seconds * INTERVAL '1 second')
+            ON CONFLICT ("key") DO UPDATE SET "holder" = EXCLUDED."holder", "expires_at" = EXCLUDED."expires_at"
+            WHERE lease."expires_at" < now() OR lease."holder" = EXCLUDED."holder"
+            RETURNING "holder";
+            """
+        ),
+        {"key": key, "holder": holder, "ttl_seconds": ttl_seconds},
+    )
+    acquired = res.first() is not None
+    conn.commit()
+    return acquired
+
+
+def is_lease_held(conn: Connection, key: str) -> bool:
+    res = conn.execute(
+        text('SELECT 1 FROM lease WHERE "key" = :key AND "expires_at" >= now();'),
+        {"key": key},
+    )
+    return res.first() is not None
+
+
+def release_lease(conn: Connection, key: str, holder: str) -> None:
+    conn.execute(
+        text('DELETE FROM lease WHERE "key" = :key AND "holder" = :holder;'),
+        {"key": key, "holder": holder},
+    )
+    conn.commit()
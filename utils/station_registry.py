@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+import pandas as pd
+from sqlalchemy import text
+from utils.sql_utils import DB_Connection
+
+STATION_REGISTRY_TTL = int(os.getenv("STATION_REGISTRY_TTL", 600))
+
+
+class StationRegistry:
+    """In-memory copy of the bike_station and weather_zone dimensions, reloaded from the db after
+    ttl_seconds or when invalidated. Each reload bumps version.
+
+    Station id validation is then a set lookup instead of a db round-trip.
+    """
+
+    _unique_instance = None
+
+    def __init__(self, ttl_seconds: int = STATION_REGISTRY_TTL):
+        if StationRegistry._unique_instance is not None:
+            raise Exception("This class is a singleton!")
+        self._ttl_seconds = ttl_seconds
+        self._stations: pd.DataFrame = None
+        self._station_ids: frozenset[int] = frozenset()
+        self._weather_zones: pd.DataFrame = None
+        self._loaded_at = None
+        self._version = 0
+        self._lock = threading.Lock()
+        StationRegistry._unique_instance = self
+
+    @classmethod
+    def get_instance(cls, ttl_seconds: int = STATION_REGISTRY_TTL):
+        if cls._unique_instance is None:
+            cls._unique_instance = cls(ttl_seconds)
+        return cls._unique_instance
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def station_ids(self) -> frozenset[int]:
+        self.__refresh_if_stale()
+        return self._station_ids
+
+    def stations(self) -> pd.DataFrame:
+        """Returns id, weather_zone_id, city, lat, lng of every station in db.bike_station"""
+        self.__refresh_if_stale()
+        return self._stations.copy()
+
+    def weather_zones(self) -> pd.DataFrame:
+        """Returns db.weather_zone"""
+        self.__refresh_if_stale()
+        return self._weather_zones.copy()
+
+    def invalidate(self) -> None:
+        """Force a reload on next access. To be called after writing to bike_station or weather_zone."""
+        with self._lock:
+            self._loaded_at = None
+
+    def __refresh_if_stale(self) -> None:
+        with self._lock:
+            if (
+                self._loaded_at is not None
+                and time.monotonic() - self._loaded_at < self._ttl_seconds
+            ):
+                return
+            with DB_Connection.from_env() as conn:
+                res = conn.execute(
+                    text(
+                        'SELECT "id", "weather_zone_id", "city", "lat", "lng" FROM bike_station;'
+                    )
+                )
+                stations = pd.DataFrame(res.all(), columns=list(res.keys()))
+                res = conn.execute(text("SELECT * FROM weather_zone;"))
+                weather_zones = pd.DataFrame(res.all(), columns=list(res.keys()))
+
+            self._stations = stations
+            self._station_ids = frozenset(stations["id"].tolist())
+            self._weather_zones = weather_zones
+            self._loaded_at = time.monotonic()
+            self._version += 1
@@ -0,0 +1,69 @@
+import threading
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import text, Connection
+
+STATUS_COLUMNS = ["full", "empty"]
+# Single row of bike_station_status_sync holding the extraction_ts of the last snapshot written
+SYNC_ROW_ID = 1
+
+
+class StationStatusState:
+    """In-memory copy of the full / empty of each station in db.bike_station_status, used to write only the
+    stations whose status changed. It is reloaded from the db when the sync timestamp stored in the db is not
+    the one of the last snapshot applied by this process, i.e. on first use or after another process wrote.
+    """
+
+    _unique_instance = None
+
+    def __init__(self):
+        if StationStatusState._unique_instance is not None:
+            raise Exception("This class is a singleton!")
+        self._status: pd.DataFrame = None  # indexed by station id
+        self._synced_at: datetime = None
+        self._lock = threading.Lock()
+        StationStatusState._unique_instance = self
+
+    @classmethod
+    def get_instance(cls):
+        if cls._unique_instance is None:
+            cls._unique_instance = cls()
+        return cls._unique_instance
+
+    def changed_rows(self, conn: Connection, df: pd.DataFrame) -> pd.DataFrame:
+        """Rows of a clean youbike snapshot whose station is new or has another full / empty than in the db"""
+        with self._lock:
+            self.__reload_if_stale(conn)
+            previous = self._status.reindex(df["id"])
+        changed = previous["full"].isna().to_numpy()
+        for c in STATUS_COLUMNS:
+            changed = changed | (previous[c].to_numpy() != df[c].to_numpy())
+        return df[changed]
+
+    def apply(self, df: pd.DataFrame, synced_at: datetime) -> None:
+        """Record rows written to the db, and the extraction_ts of the snapshot they come from.
+        To be called once the write is committed."""
+        with self._lock:
+            if self._status is None:
+                return
+            updates = df.set_index("id")[STATUS_COLUMNS]
+            self._status = updates.combine_first(self._status).astype(self._status.dtypes)
+            self._synced_at = synced_at
+
+    def invalidate(self) -> None:
+        """Force a reload on next access"""
+        with self._lock:
+            self._status = None
+            self._synced_at = None
+
+    def __reload_if_stale(self, conn: Connection) -> None:
+        db_synced_at = conn.execute(
+            text('SELECT "synced_at" FROM bike_station_status_sync WHERE "id" = :id;'),
+            {"id": SYNC_ROW_ID},
+        ).scalar()
+        if self._status is not None and db_synced_at == self._synced_at:
+            return
+        res = conn.execute(text('SELECT "id", "full", "empty" FROM bike_station_status;'))
+        status = pd.DataFrame(res.all(), columns=list(res.keys()))
+        self._status = status.set_index("id")[STATUS_COLUMNS].astype("int64")
+        self._synced_at = db_synced_at
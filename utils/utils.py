@@ -1,11 +1,24 @@
-import numpy as np
 import pandas as pd
-from datetime import datetime
-from io import BytesIO
-from utils.s3_helper import ConnectionToS3, download_from_bucket, export_file_to_s3
+from datetime import datetime, timedelta
+from utils.s3_helper import (
+    ConnectionToS3,
+    download_from_bucket,
+    export_file_to_s3,
+    read_parquet_objects,
+)
 import os
 from utils.sql_utils import DB_Connection
-from sqlalchemy import text
+from utils.snapshot_manifest import SnapshotManifest
+from utils.clean_snapshot_schema import to_storage_schema
+from utils.snapshot_compaction import (
+    compacted_key,
+    day_ts_range,
+    list_compacted_days,
+    to_snapshot_timezone,
+    today,
+)
+from utils.station_registry import StationRegistry
+from utils.geo import WeatherZoneLocator
 
 STANDARD_TS_FORMAT = "%Y-%m-%d_%H:%M:%S"
 DB_TS_FORMAT = "%Y-%m-%d %H:%M:%S"
@@ -19,41 +32,38 @@ def get_formatted_timestamp_as_str(ts: datetime) -> str:
 def get_youbike_snapshot_data_for_time_range(
     oldest_ts: pd.Timestamp, newest_ts: pd.Timestamp
 ) -> pd.DataFrame:
-    """Retrieve the snapshots for the range defined. For prediction, range is only last 120 minutes.
+    """Retrieve the snapshots with oldest_ts <= extraction_ts < newest_ts, newest first. Naive timestamps are
+    taken as Asia/Taipei. Past days are read from their compacted partition when it exists, with ranged reads of
+    the row groups in range only. Other days, the current one included, are read from the 10 minutes snapshots.
     For training, since use pyspark, probably cannot use this method.
     """
     s3 = ConnectionToS3.from_env()
-    bucket = s3.resource.Bucket(s3.bucket_name)
-
-    snapshot_files_by_key = sorted(
-        [
-            obj.key
-            for obj in bucket.objects.filter(Prefix="clean_data/youbike_dock_info_2")
-        ],
-        reverse=True,
-    )
-
-    def find_file_index_by_ts(ts: str) -> int:
-        i = 0
-        while snapshot_files_by_key[i] > f"clean_data/youbike_dock_info_{ts}":
-            i += 1
-        return i
-
-    oldest_i = find_file_index_by_ts(oldest_ts.strftime(STANDARD_TS_FORMAT))
-    newest_i = find_file_index_by_ts(newest_ts.strftime(STANDARD_TS_FORMAT))
-
-    def read_parquet_from_s3(bucket, key):
-        """Generator function to yield a DataFrame from S3"""
-        s3_res = bucket.Object(key).get()
-        yield pd.read_parquet(BytesIO(s3_res["Body"].read()))
-
-    dfs = (
-        df
-        for key in snapshot_files_by_key[newest_i:oldest_i]
-        for df in read_parquet_from_s3(bucket, key)
+    oldest_ts, newest_ts = to_snapshot_timezone(oldest_ts), to_snapshot_timezone(newest_ts)
+    oldest, newest = oldest_ts.strftime(STANDARD_TS_FORMAT), newest_ts.strftime(STANDARD_TS_FORMAT)
+
+    manifest = SnapshotManifest.from_s3(s3)
+    compacted_days = set(list_compacted_days(s3))
+    compacted_keys, snapshot_keys = [], []
+    day = oldest_ts.date()
+    while day <= newest_ts.date():
+        if day in compacted_days and day < today():
+            compacted_keys.append(compacted_key(day))
+        else:
+            day_start, day_end = day_ts_range(day)
+            snapshot_keys += manifest.keys_for_time_range(
+                max(oldest, day_start), min(newest, day_end)
+            )
+        day += timedelta(days=1)
+
+    dfs = read_parquet_objects(
+        s3,
+        compacted_keys,
+        filters=[("extraction_ts", ">=", oldest_ts), ("extraction_ts", "<", newest_ts)],
+    ) + read_parquet_objects(s3, snapshot_keys)
+    hist_df = pd.concat([to_storage_schema(df) for df in dfs], ignore_index=True)
+    return hist_df.sort_values(
+        by="extraction_ts", ascending=False, kind="stable", ignore_index=True
     )
-    hist_df = pd.concat(dfs, ignore_index=True)
-    return hist_df
 
 
 def get_latest_weather_data() -> pd.DataFrame:
@@ -73,33 +83,16 @@ def get_latest_weather_data() -> pd.DataFrame:
 
 
 def get_weather_zone() -> pd.DataFrame:
-    """Retrieve weather zones dims from db's weather_zone"""
-    with DB_Connection.from_env().connection as conn:
-        cursor_result = conn.execute(text("SELECT * FROM weather_zone;"))
-        weather_zone_df = pd.DataFrame(cursor_result.all())
-    return weather_zone_df
-
-
-def np_magnitude(coord1: pd.DataFrame, coord2: pd.DataFrame):
-    lat_vector = np.power(coord1["lat"] - coord2["lat"], 2)
-    lng_vector = np.power(coord1["lng"] - coord2["lng"], 2)
-    return np.sqrt(lat_vector + lng_vector)
+    """Retrieve weather zones dims from db's weather_zone, through the cached StationRegistry"""
+    return StationRegistry.get_instance().weather_zones()
 
 
 def identify_weather_zone(lat: pd.Series, lng: pd.Series) -> pd.Series:
     """
-    Provided a dataframe with column lat and column lng, identify what the closest weather zone is.
+    Provided a series of lat and a series of lng, identify what the closest weather zone is.
+    Returns the zone names, see utils.geo.WeatherZoneLocator.
     """
-    weather_zones = get_weather_zone()
-
-    mag = pd.DataFrame({"lat": lat, "lng": lng}).loc[:]
-
-    for i, r in weather_zones.iterrows():
-        mag[r["name"]] = np_magnitude(
-            pd.DataFrame({"lat": lat, "lng": lng}),
-            weather_zones[weather_zones["name"] == r["name"]].iloc[0],
-        )
-    return mag.drop(["lat", "lng"], axis=1).idxmin(axis=1)
+    return WeatherZoneLocator.get_instance().nearest_zone_name(lat, lng)
 
 
 if __name__ == "__main__":